@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the memory used by the source file objects, against the
+former layout: a __dict__ per file, four sets, a parser (and a Verilog
+preprocessor) per file and a copied include_dirs list.
+
+The files are only created, as when the pool is loaded: they are neither
+read nor parsed.
+
+Usage: python benchmarks/bench_file_memory.py [FILES]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hdlmake.util import path as path_mod
+from hdlmake.sourcefiles.srcfile import create_source_file
+from hdlmake.sourcefiles.vhdl_parser import VHDLParser
+from hdlmake.sourcefiles.vlog_parser import (VerilogParser,
+                                             VerilogPreprocessor)
+
+FILES_PER_DIR = 100
+
+
+class LegacyVHDLFile(object):
+    """Former layout of a VHDL file"""
+
+    def __init__(self, path, module, library=None):
+        self.library = library or "work"
+        self.path = path
+        self.module = module
+        self.provides = set()
+        self.requires = set()
+        self.depends_on = set()
+        self.included_files = set()
+        self.dep_level = None
+        self.is_parsed = False
+        self.parser = VHDLParser()
+
+
+class LegacyVerilogFile(LegacyVHDLFile):
+    """Former layout of a Verilog file"""
+
+    def __init__(self, path, module, library=None, include_dirs=None):
+        LegacyVHDLFile.__init__(self, path, module, library)
+        self.include_dirs = include_dirs[:] if include_dirs else []
+        self.include_dirs.append(path_mod.relpath(os.path.dirname(path)))
+        self.parser = VerilogParser()
+        self.parser.preprocessor = VerilogPreprocessor()
+
+
+def create_files(count, legacy):
+    """Create count VHDL and Verilog files, as if listed by the modules"""
+    include_dirs = ["/ip/common/include", "/ip/common/macros"]
+    files = []
+    for index in range(count):
+        directory = "/ip/core{}/rtl".format(index // FILES_PER_DIR)
+        if index % 2:
+            path = "{}/unit{}.vhd".format(directory, index)
+            if legacy:
+                files.append(LegacyVHDLFile(path, None, "work"))
+                continue
+        else:
+            path = "{}/unit{}.v".format(directory, index)
+            if legacy:
+                files.append(LegacyVerilogFile(path, None, "work",
+                                               include_dirs))
+                continue
+        files.append(create_source_file(path, None, "work", include_dirs))
+    return files
+
+
+def measure(count, legacy):
+    """Get the memory allocated by the files, in bytes"""
+    tracemalloc.start()
+    files = create_files(count, legacy)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del files
+    return size
+
+
+def main():
+    """Compare the memory used by both layouts"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    # Create the shared parsers and import everything beforehand
+    create_files(2, legacy=False)
+    sizes = [(name, measure(count, legacy))
+             for name, legacy in (("former", True), ("slotted", False))]
+    for name, size in sizes:
+        print("%-8s %8.1f MB for %d files, %5d bytes per file"
+              % (name, size / 1e6, count, size // count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
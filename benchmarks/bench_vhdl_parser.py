@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the single scan VHDL parser against the former parser,
+which ran one re.sub pass over the whole buffer for every construct.
+
+Both parsers are run on every VHDL file of the testsuite and on a
+generated register map, and must find the same relations.
+
+Usage: python benchmarks/bench_vhdl_parser.py [REGISTERS]
+"""
+
+from __future__ import print_function
+import os
+import re
+import sys
+import glob
+import shutil
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hdlmake.sourcefiles.dep_file import DepRelation
+from hdlmake.sourcefiles.srcfile import VHDLFile
+
+FLAGS = re.DOTALL | re.MULTILINE | re.IGNORECASE
+
+# The passes of the former parser, in order: (pattern, relation builder)
+LEGACY_PASSES = [
+    (r"^\s*use\s+(\w+)\s*\.\s*(\w+)",
+     lambda m, lib: [("requires", m.group(2), lib if m.group(1).lower() == "work"
+                      else m.group(1), DepRelation.PACKAGE)]),
+    (r"^\s*entity\s+(?P<name>\w+)\s+is\s+(?:port|generic|end)"
+     r".*?((?P=name)|entity)\s*;",
+     lambda m, lib: [("provides", m.group(1), lib, DepRelation.ENTITY)]),
+    (r"^\s*architecture\s+(?P<name>\w+)\s+of\s+(\w+)\s+is",
+     lambda m, lib: [("provides", m.group(2), lib, DepRelation.ARCHITECTURE),
+                     ("requires", m.group(2), lib, DepRelation.ENTITY)]),
+    (r"^\s*package\s+(\w+)\s+is",
+     lambda m, lib: [("provides", m.group(1), lib, DepRelation.PACKAGE)]),
+    (r"^\s*component\s+(\w+).*?end\s+component.*?;", None),
+    (r"^\s*signal\s+(\w+).*?;", None),
+    (r"^\s*constant\s+(\w+).*?;", None),
+    (r"^\s*type\s+(\w+)\s+is\s+record.*?end\s+record.*?;", None),
+    (r"^\s*function\s+(?P<name>\w+).*?return\s+\w+"
+     r"(\s+is.*?end\s+function.*?)?\s*;", None),
+    (r"^\s*(?P<LABEL>\w+)\s*:"
+     r"\s*(?:entity\s+(?P<LIB>\w+)\.)?(?P<ENTITY>\w+)"
+     r"\s*(?:\(\s*(?P<ARCH>\w+)\s*\)\s*)?"
+     r"(?:port\s+map.*?|generic\s+map.*?)",
+     lambda m, lib: [("requires", m.group("ENTITY"),
+                      lib if not m.group("LIB") or m.group("LIB") == "work"
+                      else m.group("LIB"), DepRelation.ENTITY)]),
+    (r"^\s*library\s*(\w+)\s*;", None)]
+
+
+def legacy_parse(path, library):
+    """Former multi-pass parser: return the (provides, requires) sets"""
+    relations = {"provides": set(), "requires": set()}
+    buf = open(path, "r", errors='replace').read()
+    buf = re.sub(re.compile('--.*?$|".?"', re.DOTALL | re.MULTILINE), "", buf)
+
+    for index, (pattern, builder) in enumerate(LEGACY_PASSES):
+        def replace(match):
+            """Record the relations and replace the match by a placeholder"""
+            if builder is not None:
+                for kind, name, lib, rel_type in builder(match, library):
+                    relations[kind].add(DepRelation(name, lib, rel_type))
+            return "<hdlmake %d %s>" % (index, match.group(1))
+        buf = re.sub(re.compile(pattern, FLAGS), replace, buf)
+    return relations["provides"], relations["requires"]
+
+
+def single_scan_parse(path, library):
+    """Current parser: return the (provides, requires) sets"""
+    vhdl_file = VHDLFile(path=path, module=None, library=library)
+    vhdl_file.parser.parse(vhdl_file)
+    return vhdl_file.provides, vhdl_file.requires
+
+
+def register_map(registers):
+    """Generate a big register map package and its decoder"""
+    lines = ["library ieee;", "use ieee.std_logic_1164.all;",
+             "package regs_pkg is"]
+    for reg in range(registers):
+        lines.append("  constant REG%d_ADDR : natural := %d; -- reg %d"
+                     % (reg, reg, reg))
+        lines.append("  type reg%d_t is record value : std_logic_vector"
+                     "(31 downto 0); end record;" % reg)
+    lines += ["end package;", "",
+              "library ieee;", "use ieee.std_logic_1164.all;",
+              "use work.regs_pkg.all;",
+              "entity regs is port (clk : in std_logic); end regs;",
+              "architecture rtl of regs is"]
+    for reg in range(registers):
+        lines.append("  signal reg%d : reg%d_t;" % (reg, reg))
+    lines.append("begin")
+    for reg in range(0, registers, 16):
+        lines.append("  u%d: entity work.bank port map (clk => clk);" % reg)
+    lines.append("end rtl;")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    """Compare the relations found by both parsers and their timings"""
+    registers = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    testsuite = os.path.join(os.path.dirname(__file__), '..', 'testsuite')
+    files = sorted(glob.glob(os.path.join(testsuite, '*', '*.vhd*')))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        big_file = os.path.join(tmp_dir, "regs.vhd")
+        with open(big_file, "w") as out:
+            out.write(register_map(registers))
+        files.append(big_file)
+        for path in files:
+            if legacy_parse(path, "work") != single_scan_parse(path, "work"):
+                print("MISMATCH: %s" % path)
+                return 1
+        print("Same relations found in %d files" % len(files))
+        size = os.path.getsize(big_file)
+        for name, function in (("multi-pass", legacy_parse),
+                               ("single scan", single_scan_parse)):
+            elapsed = min(timeit.repeat(lambda: function(big_file, "work"),
+                                        number=1, repeat=3))
+            print("%-12s %8.3f s for %d bytes" % (name, elapsed, size))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
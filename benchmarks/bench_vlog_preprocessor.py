@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the Verilog preprocessor on macro heavy sources, in the
+style of the UVM headers: a chain of included files defining macros that
+are expanded many times, some of them inside `ifdef blocks.
+
+The preprocessing time is measured for growing sizes, it should grow
+linearly with the number of macro expansions.
+
+Usage: python benchmarks/bench_vlog_preprocessor.py [EXPANSIONS]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hdlmake.sourcefiles.srcfile import VerilogFile
+from hdlmake.sourcefiles.vlog_parser import VerilogPreprocessor
+
+HEADERS = 8
+
+
+def write_sources(directory, expansions):
+    """Write the included headers and the top file using the macros"""
+    for index in range(HEADERS):
+        with open(os.path.join(directory, "macros%d.svh" % index), "w") as out:
+            out.write("`ifndef MACROS%d_SVH\n`define MACROS%d_SVH\n"
+                      % (index, index))
+            if index + 1 < HEADERS:
+                out.write('`include "macros%d.svh"\n' % (index + 1))
+            out.write("`define FIELD%d(name) logic [31:0] name; "
+                      "// field %d\n" % (index, index))
+            out.write("`define REG%d(name) `FIELD%d(name``_q) "
+                      "`FIELD%d(name``_d)\n" % (index, index, index))
+            out.write("`endif\n")
+    top = os.path.join(directory, "top.sv")
+    with open(top, "w") as out:
+        out.write('`include "macros0.svh"\nmodule top;\n')
+        for index in range(expansions):
+            out.write("`ifdef MACROS%d_SVH\n  `REG%d(r%d)\n`endif\n"
+                      % (index % HEADERS, index % HEADERS, index))
+        out.write("endmodule\n")
+    return top
+
+
+def main():
+    """Time the preprocessing of sources of growing size"""
+    expansions = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for size in (expansions, 2 * expansions, 4 * expansions):
+            top = write_sources(tmp_dir, size)
+            vlog_file = VerilogFile(path=top, module=None, library="work",
+                                    include_dirs=[tmp_dir])
+
+            def preprocess():
+                """Preprocess the top file with a fresh preprocessor"""
+                return VerilogPreprocessor().preprocess(vlog_file)
+            elapsed = min(timeit.repeat(preprocess, number=1, repeat=3))
+            print("%6d expansions %8.3f s  %6.1f us/expansion"
+                  % (size, elapsed, elapsed * 1e6 / size))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the token based Verilog module scanner against the former
+regular expressions, which searched the module bodies with lazy DOTALL
+patterns and split them into statements before looking for instantiations.
+
+Both scanners must find the same packages, modules and instantiations in
+the Verilog files of the testsuite and in a generated netlist.  They are
+then timed on pathological inputs of growing size: the time taken by the
+token scanner must grow linearly.
+
+Usage: python benchmarks/bench_vlog_scanner.py [SIZE]
+"""
+
+from __future__ import print_function
+import os
+import re
+import sys
+import glob
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hdlmake.sourcefiles.srcfile import VerilogFile
+from hdlmake.sourcefiles.vlog_parser import (VerilogParser,
+                                             VerilogPreprocessor,
+                                             _ModuleScanner)
+
+FLAGS = re.DOTALL | re.MULTILINE
+
+LEGACY_PACKAGE = re.compile(
+    r"package\s+(\w+)\s*(?:\(.*?\))?\s*(.+?)endpackage", FLAGS)
+LEGACY_MODULE = re.compile(
+    r"(?:module|interface)\s+(\w+)\s*(?:#\s*\(.*?\)\s*)?(?:\(.*?\))?\s*;"
+    r"\s*(.+?)(?:endmodule|endinterface)", FLAGS)
+LEGACY_INSTANTIATION = re.compile(
+    r"\s*\b(\w+)\s+(?:#\s*\(.*?\)\s*)?(\w+)\s*(?:\[.*?\]\s*)?\(.*?\)$", FLAGS)
+LEGACY_STMT = re.compile(
+    r'''(?:\s*(?:(?:\b(?:function|task)\b.*?\bend(?:function|task)\b)|'''
+    r'''(?:\bbegin(?:\s*:\s*\w+)?)|(?:\bend\b(?:\s*:\s*\w+)?)|'''
+    r'''(?:end(?:generate|case)\b)|(?:\b(?:case|if|for)\s*\(.*?\))|'''
+    r'''(?:\b(?:else|generate)\b)|'''
+    r'''\b(?:assign|localparam|wire|logic|reg)\b[^;]*?(?:=.*?)?;|'''
+    r'''\balways(?:_ff|_latch|_comb)?\b\s*(?:@\s*(?:\*|(?:\(.*?\))))?|'''
+    r''';)\s*)+''', FLAGS)
+
+
+def legacy_scan(buf):
+    """Former regular expressions: return the set of found constructs"""
+    found = set()
+    for match in LEGACY_PACKAGE.finditer(buf):
+        found.add(("package", match.group(1)))
+    for match in LEGACY_MODULE.finditer(buf):
+        found.add(("module", match.group(1)))
+        for stmt in LEGACY_STMT.split(match.group(2)):
+            if not stmt or stmt[-1] != ")":
+                continue
+            inst = LEGACY_INSTANTIATION.match(stmt)
+            if inst and inst.group(1) not in VerilogParser.reserved_set:
+                found.add(("instance", inst.group(1)))
+    return found
+
+
+def token_scan(buf):
+    """Current scanner: return the set of found constructs"""
+    return set(found[:2] for found in
+               _ModuleScanner(buf, VerilogParser.reserved_set).scan())
+
+
+def netlist(size):
+    """Generate a flat netlist instantiating size cells"""
+    lines = ["module top #(parameter W = 8) (input clk, output [W-1:0] q);",
+             "  wire [W-1:0] n0;"]
+    for cell in range(size):
+        lines.append("  CELL%d #(.INIT(8'h%02x)) u%d (.C(clk), .I(n%d[%d]),"
+                     " .O(n%d[%d]));" % (cell % 7, cell % 256, cell, cell,
+                                         cell % 8, cell + 1, cell % 8))
+        lines.append("  wire [W-1:0] n%d;" % (cell + 1))
+    lines += ["  assign q = n%d;" % size, "endmodule", ""]
+    for cell in range(7):
+        lines.append("module CELL%d (input C, input I, output O);"
+                     " assign O = I; endmodule" % cell)
+    return "\n".join(lines) + "\n"
+
+
+# Inputs making the former regular expressions backtrack: each one of the
+# repeated constructs is never closed, so the lazy patterns scan the rest
+# of the buffer from every one of them.
+PATHOLOGICAL = [
+    ("unclosed headers", lambda size: "module m (input a,\n" * size),
+    ("unclosed conditions", lambda size: "module m;\n" +
+     "  if (a\n" * size + "endmodule\n"),
+    ("unclosed packages", lambda size: "package p;\n" * size)]
+
+
+def main():
+    """Compare the constructs found by both scanners and their timings"""
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    testsuite = os.path.join(os.path.dirname(__file__), '..', 'testsuite')
+    buffers = []
+    for path in sorted(glob.glob(os.path.join(testsuite, '*', '*.v')) +
+                       glob.glob(os.path.join(testsuite, '*', '*.sv'))):
+        vlog_file = VerilogFile(path=path, module=None, include_dirs=[
+            os.path.join(os.path.dirname(path), "inc")])
+        try:
+            buffers.append((path, VerilogPreprocessor().preprocess(vlog_file)))
+        except Exception:
+            # Preprocessor error cases of the testsuite
+            continue
+    buffers.append(("netlist", netlist(size)))
+    for path, buf in buffers:
+        if legacy_scan(buf) != token_scan(buf):
+            print("MISMATCH: %s" % path)
+            return 1
+    print("Same constructs found in %d files" % len(buffers))
+    for name, generate in PATHOLOGICAL:
+        print(name)
+        for count in (size, 2 * size, 4 * size):
+            buf = generate(count)
+            for scanner_name, scanner in (("regexps", legacy_scan),
+                                          ("tokens", token_scan)):
+                elapsed = min(timeit.repeat(lambda: scanner(buf),
+                                            number=1, repeat=3))
+                print("  %-8s %6d constructs %8.3f s"
+                      % (scanner_name, count, elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -30,44 +30,55 @@ import sys
 
 from ..tools.load_tool import load_syn_tool, load_sim_tool
 from ..util import shell
+from ..util.path import PathScanner
 from ..sourcefiles import new_dep_solver as dep_solver
 from ..sourcefiles.srcfile import VHDLFile, VerilogFile, SVFile
 from ..sourcefiles.sourcefileset import SourceFileSet
 from ..module.module import Module, ModuleArgs
+from ..module.pool_cache import PoolCache
+from ..manifest_parser.code_cache import ManifestCodeCache
 
 class Action(object):
 
     """This is the base class providing the common Action methods"""
 
+    # The folder of the on-disk caches, in the top module
+    CACHE_DIR = ".hdlmake-cache"
+
     def __init__(self, options):
         super(Action, self).__init__()
         self.top_manifest = None
         self.manifests = []
+        self._manifests_by_url = {}
         self.parseable_fileset = SourceFileSet()
         self.privative_fileset = SourceFileSet()
         self._deps_solved = False
         self.options = options
-
-    def __contains(self, module):
-        """Check if the pool contains the given module by checking the URL"""
-        for mod in self.manifests:
-            if mod.url == module.url:
-                return True
-        return False
+        self.manifest_code_cache = None
+        self.path_scanner = PathScanner()
 
     def new_module(self, parent, url, source, fetchto):
         """Add new module to the pool.
 
         This is the only way to add new modules to the pool
-        Thanks to it the pool can easily control its content
+        Thanks to it the pool can easily control its content:
+        a module is identified by its URL, so the instance already in
+        the pool is returned if the URL has been added before.
         """
         self._deps_solved = False
         args = ModuleArgs()
         args.set_args(parent, url, source, fetchto)
-        new_module = Module(args, self)
-        if not self.__contains(new_module):
-            self.manifests.append(new_module)
-        return new_module
+        module = self._manifests_by_url.get(args.get_url())
+        if module is None:
+            module = Module(args, self)
+            self._manifests_by_url[module.url] = module
+            self.manifests.append(module)
+        return module
+
+    def index_manifests(self):
+        """Rebuild the URL index of the modules in the pool"""
+        self._manifests_by_url = dict(
+            (module.url, module) for module in self.manifests)
 
     def load_all_manifests(self):
         # Top level module.
@@ -76,7 +87,27 @@ class Action(object):
                                             url=os.getcwd(),
                                             source=None,
                                             fetchto=".")
-        # Parse the top manifest and all sub-modules.
+        pool_cache = None
+        cache_dir = self.get_cache_dir()
+        if cache_dir is not None:
+            if self.options.pool_cache:
+                # Nothing to parse if the snapshot of the pool is still valid
+                pool_cache = PoolCache(cache_dir)
+                if pool_cache.restore(self):
+                    return
+            self.manifest_code_cache = ManifestCodeCache(cache_dir)
+            self.manifest_code_cache.load()
+        if pool_cache is None:
+            self._parse_all_manifests()
+        else:
+            with pool_cache.record_warnings():
+                self._parse_all_manifests()
+            pool_cache.store(self)
+        if self.manifest_code_cache is not None:
+            self.manifest_code_cache.save()
+
+    def _parse_all_manifests(self):
+        """Parse the top manifest and all sub-modules"""
         self.top_manifest.parse_manifest()
 
     def setup(self):
@@ -143,14 +174,26 @@ class Action(object):
             logging.info("Detected %d supported files that can be parsed",
                          len(self.parseable_fileset))
 
+    def get_cache_dir(self):
+        """Get the directory for the on-disk caches, None if disabled"""
+        if self.options.no_cache:
+            return None
+        return os.path.join(self.top_manifest.path, self.CACHE_DIR)
+
     def solve_file_set(self):
         """Build file set with only those files required by the top entity"""
         if not self._deps_solved:
             if self.tool == None:
-                dep_solver.solve(self.parseable_fileset)
+                dep_solver.solve(self.parseable_fileset,
+                                 cache_dir=self.get_cache_dir(),
+                                 jobs=self.options.jobs,
+                                 strict_cycles=self.options.strict_cycles)
             else:
                 dep_solver.solve(self.parseable_fileset,
-                                 self.tool.get_standard_libs())
+                                 self.tool.get_standard_libs(),
+                                 cache_dir=self.get_cache_dir(),
+                                 jobs=self.options.jobs,
+                                 strict_cycles=self.options.strict_cycles)
             self._deps_solved = True
         if self.options.all_files:
             return
@@ -23,18 +23,21 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+import collections
 import logging
 import os
+import shutil
 import sys
-import os.path
 
 from ..sourcefiles import new_dep_solver as dep_solver
 from ..util import path as path_mod
 from ..fetch.svn import Svn
 from ..fetch.git import Git, GitSM
 from ..fetch.local import Local
+from ..fetch.lockfile import LockFile
 from .action import Action
 from ..util import shell
+from ..util.runner import runner
 
 
 class Commands(Action):
@@ -47,6 +50,7 @@ class Commands(Action):
         self.gitsm_backend = GitSM()
         self.svn_backend = Svn()
         self.local_backend = Local()
+        self.fetch_lock = None
 
     def _check_all_fetched(self):
         """Check if every module in the pool is fetched"""
@@ -76,61 +80,178 @@ class Commands(Action):
                                  combined_fileset,
                                  filename=filename)
 
+    def _get_backend(self, module):
+        """Get the fetcher of the given remote module"""
+        if module.source == 'svn':
+            return self.svn_backend
+        elif module.source == 'git':
+            return self.git_backend
+        assert module.source == 'gitsm'
+        return self.gitsm_backend
+
+    def _remote_modules(self):
+        """Get the fetched remote modules of the pool"""
+        return [mod_aux for mod_aux in self.manifests
+                if mod_aux.source in ['git', 'gitsm', 'svn']
+                and mod_aux.isfetched]
+
+    def _verify_lock(self):
+        """Compare the revision of the fetched modules with the lock file,
+        without any network access, and check out the locked revision of
+        the modules that diverged only"""
+        diverged = 0
+        for mod_aux in self._remote_modules():
+            locked = self.fetch_lock.locked_revision(mod_aux)
+            if locked is None:
+                logging.debug("Module %s is not locked", mod_aux.url)
+                continue
+            backend = self._get_backend(mod_aux)
+            current = backend.get_revision(mod_aux)
+            if current == locked:
+                logging.debug("Module %s matches the lock", mod_aux.url)
+                continue
+            diverged += 1
+            logging.info("Module %s diverged from the lock (%s instead of "
+                         "%s), checking it out", mod_aux.url, current, locked)
+            if not backend.update(mod_aux, locked):
+                raise Exception(
+                    "Unable to check out the locked revision {} of module "
+                    "{}".format(locked, mod_aux.url))
+        logging.info("%d module(s) diverged from %s", diverged,
+                     self.fetch_lock.path)
+
+    def _update_lock(self):
+        """Record the revision of every fetched module in the lock file"""
+        urls = set()
+        for mod_aux in self._remote_modules():
+            revision = self._get_backend(mod_aux).get_revision(mod_aux)
+            if revision is None:
+                logging.warning("Cannot get the revision of module %s",
+                                mod_aux.url)
+                continue
+            self.fetch_lock.record(mod_aux, revision)
+            urls.add(mod_aux.url)
+        for url in list(self.fetch_lock.entries):
+            if url not in urls:
+                del self.fetch_lock.entries[url]
+                self.fetch_lock.modified = True
+        self.fetch_lock.save()
+
+    def _fetch_module(self, module):
+        """Fetch the given module from the remote origin.  Return None on
+        success, or the error that made the fetch fail"""
+        logging.debug("Fetching module: %s", str(module))
+        if self.fetch_lock is not None:
+            module.locked_revision = self.fetch_lock.locked_revision(module)
+        try:
+            result = self._get_backend(module).fetch(module)
+        except Exception as error:
+            return error
+        if result is False:
+            return "fetch command failed"
+        return None
+
     def _fetch_all(self):
-        """Fetch all the modules declared in the design"""
-
-        def _fetch_module(module):
-            """Fetch the given module from the remote origin"""
-            new_modules = []
-            logging.debug("Fetching module: %s", str(module))
-            if module.source == 'svn':
-                result = self.svn_backend.fetch(module)
-            elif module.source == 'git':
-                result = self.git_backend.fetch(module)
-            else:
-                assert module.source == 'gitsm'
-                result = self.gitsm_backend.fetch(module)
-            if result is False:
-                raise Exception("Unable to fetch module {}".format(module.url))
-            module.parse_manifest()
-            for m in module.modules:
-                new_modules.extend(module.modules[m])
-            return new_modules
-
-        fetch_queue = self.manifests[:] # Need a copy of the list
-
-        while len(fetch_queue) > 0:
-            cur_mod = fetch_queue.pop()
-            new_modules = []
-            if cur_mod.isfetched:
-                new_modules = cur_mod.submodules()
-            else:
-                new_modules = _fetch_module(cur_mod)
-            for mod in new_modules:
-                if not mod.isfetched:
-                    logging.debug("Appended to fetch queue: "
-                                  + str(mod.url))
-                    fetch_queue.append(mod)
+        """Fetch all the modules declared in the design, and the ones
+        declared by the fetched modules.  Up to 'jobs' modules are fetched
+        concurrently: the manifest of a module is parsed as soon as it is
+        fetched, so that its own submodules are queued at once.  A failed
+        fetch doesn't stop the other ones, the failures of all the modules
+        are reported at the end"""
+        jobs = self.options.jobs
+        queue = collections.deque()
+        queued = set()
+        failures = []
+        # Number of the fetched modules, and of the queued ones
+        progress = [0, 0]
+
+        def _enqueue(modules):
+            """Queue the unfetched modules, looking for them through the
+            already fetched ones"""
+            for mod in modules:
+                if mod in queued:
+                    continue
+                queued.add(mod)
+                if mod.isfetched:
+                    logging.debug("NOT appended to fetch queue: %s", mod.url)
+                    _enqueue(mod.submodules())
                 else:
-                    logging.debug("NOT appended to fetch queue: "
-                                  + str(mod.url))
+                    logging.debug("Appended to fetch queue: %s", mod.url)
+                    queue.append(mod)
+                    progress[1] += 1
+
+        def _done(module, error):
+            """Handle the result of the fetch of module"""
+            progress[0] += 1
+            if error is not None:
+                logging.error("[%d/%d] Unable to fetch module %s: %s",
+                              progress[0], progress[1], module.url, error)
+                failures.append((module, error))
+                return
+            logging.info("[%d/%d] Fetched module %s",
+                         progress[0], progress[1], module.url)
+            # The fetches running in the other threads rely on the current
+            # directory, it must not be changed by the manifests
+            module.parse_manifest(change_dir=jobs == 1)
+            _enqueue(module.submodules())
+
+        _enqueue(self.manifests[:])
+        if jobs == 1:
+            while queue:
+                module = queue.popleft()
+                _done(module, self._fetch_module(module))
+        else:
+            from concurrent.futures import (ThreadPoolExecutor, wait,
+                                            FIRST_COMPLETED)
+            running = {}
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                while queue or running:
+                    while queue:
+                        module = queue.popleft()
+                        running[executor.submit(
+                            self._fetch_module, module)] = module
+                    finished = wait(running, return_when=FIRST_COMPLETED)[0]
+                    for future in finished:
+                        _done(running.pop(future), future.result())
+        if failures:
+            raise Exception(
+                "Unable to fetch {} module(s):\n {}".format(
+                    len(failures),
+                    "\n ".join(["{}: {}".format(module.url, error)
+                                for module, error in failures])))
+
+    def _run_fetch_hooks(self, hook):
+        """Run the given hook command line of the fetched modules, one after
+        the other in the order of the modules.  The hooks inherit the input
+        of hdlmake, so that they can prompt the user"""
+        for mod in self.manifests:
+            if (mod.isfetched and mod.manifest_dict
+                    and mod.manifest_dict.get(hook)):
+                result = runner.run(mod.manifest_dict[hook], check=False,
+                                    echo=print, stdin=None)
+                if result.returncode != 0:
+                    logging.warning("The %s of module %s failed with exit "
+                                    "code %d", hook, mod.url,
+                                    result.returncode)
 
     def fetch(self):
         """Fetch the missing required modules from their remote origin"""
         logging.info("Fetching needed modules.")
-        for mod in self.manifests:
-            if mod.isfetched and not mod.manifest_dict == None:
-                if 'fetch_pre_cmd' in mod.manifest_dict:
-                    os.system(mod.manifest_dict.get("fetch_pre_cmd", ''))
+        runner.configure(jobs=self.options.jobs,
+                         timeout=self.options.__dict__.get('timeout'))
+        self.fetch_lock = LockFile(self.top_manifest.path)
+        self.fetch_lock.load()
+        if self.options.__dict__.get('verify'):
+            self._verify_lock()
+        self._run_fetch_hooks("fetch_pre_cmd")
         self._fetch_all()
-        for mod in self.manifests:
-            if mod.isfetched and not mod.manifest_dict == None:
-                if 'fetch_post_cmd' in mod.manifest_dict:
-                    os.system(mod.manifest_dict.get("fetch_post_cmd", ''))
+        self._run_fetch_hooks("fetch_post_cmd")
+        self._update_lock()
         logging.info("All modules fetched.")
 
     def clean(self):
-        """Delete the local copy of the fetched modules"""
+        """Delete the local copy of the fetched modules, and the on-disk
+        caches"""
         logging.info("Removing fetched modules..")
         remove_list = [mod_aux for mod_aux in self.manifests
                        if mod_aux.source in ['git', 'gitsm', 'svn']
@@ -144,6 +265,10 @@ class Commands(Action):
         else:
             logging.info("There are no modules to be removed")
         logging.info("Modules cleaned.")
+        cache_dir = os.path.join(self.top_manifest.path, self.CACHE_DIR)
+        if os.path.isdir(cache_dir):
+            logging.info("Removing the cache in %s", cache_dir)
+            shutil.rmtree(cache_dir)
 
     def list_files(self):
         """List the files added to the design across the pool hierarchy"""
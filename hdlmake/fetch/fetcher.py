@@ -21,10 +21,35 @@
 
 """Module providing the base class for the different code fetchers"""
 
+import os
+
+
 class Fetcher(object):
 
     """Base class for the code fetcher objects"""
 
+    @staticmethod
+    def make_fetchto(module):
+        """Create the fetchto folder of the module if it doesn't exist yet,
+        the sibling modules may be fetched concurrently.  Return its path"""
+        fetchto = module.fetchto()
+        try:
+            os.mkdir(fetchto)
+        except OSError:
+            if not os.path.isdir(fetchto):
+                raise
+        return fetchto
+
     def fetch(self, module):
         """Stub method, this must be implemented by the code fetcher"""
         pass
+
+    def get_revision(self, module):
+        """Get the revision checked out for the fetched module, without any
+        network access.  None if unknown"""
+        return None
+
+    def update(self, module, revision):
+        """Check out the given revision of the fetched module, return
+        False if not supported.  A CommandError is raised on failure"""
+        return False
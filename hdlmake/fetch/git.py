@@ -23,12 +23,25 @@
 
 from __future__ import absolute_import
 import os
+import shutil
+import hashlib
 from ..util import path as path_utils
-from ..util import shell
-from subprocess import PIPE, Popen
+from ..util.runner import runner, CommandError
 import logging
 from .fetcher import Fetcher
 
+# Environment variable giving the directory of the shared Git mirrors
+MIRROR_ENV = "HDLMAKE_GIT_MIRROR"
+
+# The values of the fetch_strategy manifest variable
+FETCH_STRATEGIES = ("full", "shallow", "partial", "sparse")
+
+# The options of the submodule updates for every fetch strategy
+SUBMODULE_OPTIONS = {"full": [],
+                     "shallow": ["--depth", "1"],
+                     "partial": ["--filter=blob:none"],
+                     "sparse": ["--filter=blob:none"]}
+
 
 class Git(Fetcher):
 
@@ -40,8 +53,9 @@ class Git(Fetcher):
 
     def get_submodule_commit(self, submodule_dir):
         """Get the commit for a repository if defined in Git submodules"""
-        status_line = shell.run("git submodule status %s" % submodule_dir)
-        status_line = status_line.split()
+        status_line = runner.run(
+            ["git", "submodule", "status", submodule_dir]).first_line()
+        status_line = (status_line or "").split()
         if len(status_line) == 2 or len(status_line) == 3:
             if status_line[0][0] in ['-', '+', 'U']:
                 return status_line[0][1:]
@@ -50,18 +64,181 @@ class Git(Fetcher):
         else:
             return None
 
+    @staticmethod
+    def mirror_dir(module):
+        """Get the directory of the shared Git mirrors: the one given by the
+        HDLMAKE_GIT_MIRROR environment variable, or else by the fetch_mirror
+        variable of the top manifest.  None if no mirror is used"""
+        mirror_dir = os.environ.get(MIRROR_ENV)
+        if mirror_dir:
+            return os.path.abspath(mirror_dir)
+        top_manifest = module.action.top_manifest
+        mirror_dir = top_manifest.manifest_dict.get("fetch_mirror")
+        if mirror_dir:
+            return os.path.abspath(
+                path_utils.rel2abs(mirror_dir, top_manifest.path))
+        return None
+
+    @staticmethod
+    def _has_commit(mirror, checkout_id):
+        """Check if checkout_id is a known commit, branch or tag in the
+        mirror repository"""
+        return runner.succeeds(["git", "--git-dir", mirror, "rev-parse",
+                                "--quiet", "--verify",
+                                checkout_id + "^{commit}"])
+
+    def update_mirror(self, mirror_dir, url, checkout_id):
+        """Get the path of the bare mirror of url in mirror_dir.  It is
+        created if missing, and updated from url only if checkout_id is not
+        in it.  None if the mirror cannot be created or updated"""
+        name = "{}-{}.git".format(
+            path_utils.url_basename(url),
+            hashlib.sha1(url.encode("utf-8")).hexdigest()[:12])
+        mirror = os.path.join(mirror_dir, name)
+        if not os.path.isdir(mirror):
+            logging.info("Creating the mirror of %s in %s", url, mirror)
+            try:
+                os.makedirs(mirror_dir)
+            except OSError:
+                if not os.path.isdir(mirror_dir):
+                    raise
+            # Cloned aside, as another workspace may use the mirrors too
+            tmp_mirror = "{}.tmp{}".format(mirror, os.getpid())
+            try:
+                runner.run(["git", "clone", "--quiet", "--mirror", url,
+                            tmp_mirror])
+            except CommandError as error:
+                logging.debug(error)
+                shutil.rmtree(tmp_mirror, ignore_errors=True)
+                return None
+            # Allow the partial and shallow clones of the mirror
+            for option in ("uploadpack.allowFilter",
+                           "uploadpack.allowAnySHA1InWant"):
+                runner.run(["git", "--git-dir", tmp_mirror, "config", option,
+                            "true"], check=False)
+            try:
+                os.rename(tmp_mirror, mirror)
+            except OSError:
+                shutil.rmtree(tmp_mirror, ignore_errors=True)
+        elif (checkout_id is not None
+              and not self._has_commit(mirror, checkout_id)):
+            logging.info("Updating the mirror of %s for %s", url, checkout_id)
+            try:
+                runner.run(["git", "--git-dir", mirror, "remote", "update",
+                            "--prune"])
+            except CommandError as error:
+                logging.debug(error)
+                return None
+        return mirror
+
+    @staticmethod
+    def fetch_strategy(module):
+        """Get the strategy used to fetch the module: the fetch_strategy
+        variable of the closest manifest declaring it, 'full' by default"""
+        parent = module.parent
+        while parent is not None:
+            strategy = (parent.manifest_dict or {}).get("fetch_strategy")
+            if strategy:
+                if strategy not in FETCH_STRATEGIES:
+                    raise Exception(
+                        "Unknown fetch_strategy '{}' in {}, must be one "
+                        "of: {}".format(strategy, parent.path,
+                                        ", ".join(FETCH_STRATEGIES)))
+                return strategy
+            parent = parent.parent
+        return "full"
+
+    @staticmethod
+    def _clone(strategy, source, fetchto, basename, checkout_id):
+        """Clone the repository from source to fetchto/basename following
+        the strategy.  Return True if the requested checkout_id is already
+        checked out"""
+        if strategy == "shallow":
+            if checkout_id is None:
+                runner.run(["git", "clone", "--quiet", "--depth", "1",
+                            source, basename], cwd=fetchto)
+                return True
+            if runner.succeeds(["git", "clone", "--quiet", "--depth", "1",
+                                "--branch", checkout_id, source, basename],
+                               cwd=fetchto):
+                return True
+            # Not a branch nor a tag: fetch the single commit, or the whole
+            # history if the server doesn't allow to fetch a commit
+            mod_path = os.path.join(fetchto, basename)
+            shutil.rmtree(mod_path, ignore_errors=True)
+            runner.run(["git", "init", "--quiet", basename], cwd=fetchto)
+            runner.run(["git", "remote", "add", "origin", source],
+                       cwd=mod_path)
+            if runner.succeeds(["git", "fetch", "--quiet", "--depth", "1",
+                                "origin", checkout_id], cwd=mod_path):
+                runner.run(["git", "checkout", "--quiet", "--detach",
+                            "FETCH_HEAD"], cwd=mod_path)
+                return True
+            runner.run(["git", "fetch", "--quiet", "origin"], cwd=mod_path)
+            return False
+        options = {"full": [],
+                   "partial": ["--filter=blob:none"],
+                   "sparse": ["--filter=blob:none", "--sparse"]}[strategy]
+        runner.run(["git", "clone", "--quiet"] + options + [source, basename],
+                   cwd=fetchto)
+        return False
+
+    @staticmethod
+    def sparse_dirs(manifest_dict, tree_dirs):
+        """Get the directories of a module referenced by its manifest
+        dictionary, i.e. the ones holding its files, include dirs, included
+        makefiles and local modules.  tree_dirs are the directories of the
+        module repository, all the paths are relative to the module"""
+        paths = []
+        for key in ("files", "include_dirs", "incl_makefiles"):
+            paths.extend(path_utils.flatten_list(manifest_dict.get(key)))
+        paths.extend(path_utils.flatten_list(
+            (manifest_dict.get("modules") or {}).get("local")))
+        dirs = set()
+        for path in paths:
+            path = os.path.normpath(path).replace(os.sep, "/")
+            if os.path.isabs(path) or path.split("/")[0] == "..":
+                continue
+            if path_utils.has_magic(path):
+                # A pattern is expanded from its first magic directory
+                parts = path.split("/")
+                while parts and not path_utils.has_magic(parts[-1]):
+                    parts.pop()
+                while parts and path_utils.has_magic(parts[-1]):
+                    parts.pop()
+                path = "/".join(parts)
+                if path:
+                    dirs.add(path)
+            elif path in tree_dirs:
+                dirs.add(path)
+            elif "/" in path:
+                dirs.add(os.path.dirname(path))
+        return sorted(dirs)
+
+    def _sparse_checkout(self, module, mod_path):
+        """Restrict the checkout of the freshly cloned module to the
+        directories referenced by its manifest"""
+        result = runner.run(["git", "ls-tree", "-d", "-r", "--name-only",
+                             "HEAD"], cwd=mod_path)
+        tree_dirs = set(result.output.splitlines())
+        dirs = self.sparse_dirs(module.load_manifest_dict(), tree_dirs)
+        logging.debug("Sparse checkout of %s: %s", mod_path, dirs)
+        runner.run(["git", "sparse-checkout", "set"] + dirs, cwd=mod_path)
+
     def fetch(self, module):
-        """Get the code from the remote Git repository"""
-        fetchto = module.fetchto()
-        if not os.path.exists(fetchto):
-            os.mkdir(fetchto)
+        """Get the code from the remote Git repository, or from its shared
+        mirror if any, following the fetch strategy of the module"""
+        fetchto = self.make_fetchto(module)
         basename = path_utils.url_basename(module.url)
         mod_path = os.path.join(fetchto, basename)
         assert not module.isfetched
+        strategy = self.fetch_strategy(module)
         logging.info("Fetching git module %s", mod_path)
-        shell.run("(cd {0} && git clone {1})".format(fetchto, module.url))
         checkout_id = None
-        if module.branch is not None:
+        if module.locked_revision is not None:
+            checkout_id = module.locked_revision
+            logging.debug("Git commit locked: %s", checkout_id)
+        elif module.branch is not None:
             checkout_id = module.branch
             logging.debug("Git branch requested: %s", checkout_id)
         elif module.revision is not None:
@@ -70,22 +247,63 @@ class Git(Fetcher):
         else:
             checkout_id = self.get_submodule_commit(module.path)
             logging.debug("Git submodule commit: %s", checkout_id)
-        if checkout_id is not None:
+        mirror = None
+        mirror_dir = self.mirror_dir(module)
+        if mirror_dir is not None:
+            mirror = self.update_mirror(mirror_dir, module.url, checkout_id)
+            if mirror is None:
+                logging.warning("Cannot use the mirror of %s in %s",
+                                module.url, mirror_dir)
+        checked_out = False
+        if mirror is None and strategy == "full":
+            runner.run(["git", "clone", module.url], cwd=fetchto)
+        else:
+            source = module.url
+            if mirror is not None:
+                # The depth and the filter are ignored by the local clones
+                source = mirror if strategy == "full" else "file://" + mirror
+            logging.debug("Git fetch strategy: %s", strategy)
+            checked_out = self._clone(strategy, source, fetchto, basename,
+                                      checkout_id)
+            if mirror is not None:
+                # The clone of the mirror then refers to the remote
+                runner.run(["git", "remote", "set-url", "origin",
+                            module.url], cwd=mod_path)
+        if checkout_id is not None and not checked_out:
             logging.info("Checking out version %s", checkout_id)
-            cmd = "(cd {0} && git checkout {1})"
-            cmd = cmd.format(mod_path, checkout_id)
-            if os.system(cmd) != 0:
-                return False
+            runner.run(["git", "checkout", checkout_id], cwd=mod_path)
+        if strategy == "sparse":
+            self._sparse_checkout(module, mod_path)
         if self.submodule and not module.isfetched:
-            cmd = ("(cd {0} && git submodule init &&"
-                "git submodule update --recursive)")
-            cmd = cmd.format(mod_path)
-            if os.system(cmd) != 0:
-                return False
+            runner.run(["git", "submodule", "init"], cwd=mod_path)
+            runner.run(["git", "submodule", "update", "--recursive"]
+                       + SUBMODULE_OPTIONS[strategy], cwd=mod_path)
         module.isfetched = True
         module.path = mod_path
         return True
 
+    def get_revision(self, module):
+        """Get the commit checked out for the fetched module"""
+        result = runner.run(["git", "rev-parse", "--verify", "--quiet",
+                             "HEAD"], cwd=module.path, check=False)
+        if result.returncode != 0:
+            return None
+        return result.first_line()
+
+    def update(self, module, revision):
+        """Check out the given commit of the fetched module, fetching it
+        from the remote only if it is missing"""
+        if not runner.succeeds(["git", "checkout", "--quiet", revision],
+                               cwd=module.path):
+            runner.run(["git", "fetch", "--quiet", "origin"],
+                       cwd=module.path)
+            runner.run(["git", "checkout", "--quiet", revision],
+                       cwd=module.path)
+        if self.submodule:
+            runner.run(["git", "submodule", "update", "--init",
+                        "--recursive"], cwd=module.path)
+        return True
+
 
 class GitSM(Git):
     def __init__(self):
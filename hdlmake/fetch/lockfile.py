@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Module providing the lock file of the fetched remote modules"""
+
+from __future__ import absolute_import
+import os
+import json
+import logging
+
+from ..util import path as path_mod
+
+
+class LockFile(object):
+
+    """Class providing the hdlmake.lock file of the top module, recording
+    the commit or revision checked out for every fetched remote module.
+
+    An entry is only used for a module with the same URL, source and
+    requested branch or revision, so that a change in a manifest takes
+    precedence over the lock"""
+
+    LOCK_FILE = "hdlmake.lock"
+    FORMAT = 1
+
+    def __init__(self, top_path):
+        self.path = os.path.join(top_path, self.LOCK_FILE)
+        self.entries = {}
+        self.modified = False
+
+    def load(self):
+        """Load the lock file, if any"""
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r") as lock_file:
+                content = json.load(lock_file)
+        except (IOError, OSError, ValueError) as error:
+            raise Exception("Cannot read {}: {}".format(self.path, error))
+        if content.get("format") != self.FORMAT:
+            raise Exception("Unknown format of {}".format(self.path))
+        self.entries = content.get("modules", {})
+
+    def save(self):
+        """Write the lock file if it was modified"""
+        if not self.modified:
+            return
+        content = {"format": self.FORMAT, "modules": self.entries}
+        with open(self.path, "w") as lock_file:
+            json.dump(content, lock_file, indent=2, sort_keys=True)
+            lock_file.write("\n")
+        self.modified = False
+        logging.info("Fetched revisions written to %s", self.path)
+
+    def locked_revision(self, module):
+        """Get the revision locked for the module, None if not locked"""
+        entry = self.entries.get(module.url)
+        if (entry is None or entry["source"] != module.source
+                or entry["branch"] != module.branch
+                or entry["revision"] != module.revision):
+            return None
+        return entry["locked"]
+
+    def record(self, module, revision):
+        """Record the revision checked out for the module"""
+        entry = {"source": module.source,
+                 "path": path_mod.relpath(module.path),
+                 "branch": module.branch,
+                 "revision": module.revision,
+                 "locked": revision}
+        if self.entries.get(module.url) != entry:
+            self.entries[module.url] = entry
+            self.modified = True
@@ -25,6 +25,7 @@ from __future__ import absolute_import
 import os
 import logging
 from ..util import path as path_utils
+from ..util.runner import runner
 from .fetcher import Fetcher
 
 
@@ -38,21 +39,29 @@ class Svn(Fetcher):
 
     def fetch(self, module):
         """Get the code from the remote SVN repository"""
-        fetchto = module.fetchto()
-        if not os.path.exists(fetchto):
-            os.mkdir(fetchto)
+        fetchto = self.make_fetchto(module)
         basename = path_utils.svn_basename(module.url)
         mod_path = os.path.join(fetchto, basename)
-        cmd = "cd {0} && svn checkout {1} " + basename
-        if module.revision:
-            cmd = cmd.format(fetchto, module.url + '@' + module.revision)
-        else:
-            cmd = cmd.format(fetchto, module.url)
-        success = True
+        url = module.url
+        revision = module.locked_revision or module.revision
+        if revision:
+            url = module.url + '@' + revision
         logging.info("Checking out module %s", mod_path)
-        logging.debug(cmd)
-        if os.system(cmd) != 0:
-            success = False
+        runner.run(["svn", "checkout", url, basename], cwd=fetchto)
         module.isfetched = True
         module.path = mod_path
-        return success
+        return True
+
+    def get_revision(self, module):
+        """Get the revision of the working copy of the fetched module"""
+        result = runner.run(["svn", "info", "--show-item", "revision"],
+                            cwd=module.path, check=False)
+        if result.returncode != 0:
+            return None
+        return result.first_line()
+
+    def update(self, module, revision):
+        """Update the working copy of the fetched module to revision"""
+        runner.run(["svn", "update", "--quiet", "-r", revision],
+                   cwd=module.path)
+        return True
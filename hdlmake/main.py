@@ -102,6 +102,19 @@ def _get_version_string(prog):
     return "{} {} [tool:{} cmd:{}]".format(prog, __version__, tool, cmd)
 
 
+def _jobs_type(value):
+    """Convert the number of jobs, which must be at least 1"""
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid int value: '{}'".format(value))
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(
+            "the number of jobs must be at least 1: {}".format(value))
+    return jobs
+
+
 def _get_parser():
     """This is the parser function, where options and commands are defined.
     """
@@ -128,13 +141,21 @@ def _get_parser():
         "--windows", action='store_const', dest='make', const='windows',
         help="select a mingw/windows 'make' on windows platforms")
 
-    subparsers.add_parser(
+    fetch = subparsers.add_parser(
         "fetch",
         help="fetch and/or update all of the remote modules")
+    fetch.add_argument(
+        "--verify", default=False, action="store_true", dest="verify",
+        help="check out again the fetched modules whose revision differs "
+             "from hdlmake.lock, without network access for the others")
+    fetch.add_argument(
+        "--timeout", default=None, type=float, dest="timeout",
+        help="maximum duration in seconds of every fetch command")
 
     subparsers.add_parser(
         "clean",
-        help="clean all of the already fetched remote modules")
+        help="clean all of the already fetched remote modules, and the "
+             "cache in .hdlmake-cache")
 
     listmod = subparsers.add_parser(
         "list-mods",
@@ -193,6 +214,22 @@ def _get_parser():
     parser.add_argument(
         "-s", "--suffix", dest="suffix_code", default="",
         help="Python code executed after every Manifest.py")
+    parser.add_argument(
+        "-j", "--jobs", dest="jobs", default=1, type=_jobs_type,
+        help="number of processes used to parse the HDL files, "
+             "and of threads used to fetch the modules")
+    parser.add_argument(
+        "--strict-cycles", default=False, action="store_true",
+        dest="strict_cycles",
+        help="consider circular dependencies between files as errors")
+    parser.add_argument(
+        "--no-cache", default=False, action="store_true", dest="no_cache",
+        help="do not use nor update the cache in .hdlmake-cache")
+    parser.add_argument(
+        "--pool-cache", default=False, action="store_true",
+        dest="pool_cache",
+        help="keep a snapshot of the module pool in .hdlmake-cache, so that "
+             "the unchanged manifests are not executed again")
     parser.add_argument(
         "--full-error", default=False, action="store_true", dest="full_error",
         help="display full error log with traceback")
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Module providing the persistent cache for the compiled Manifest.py code"""
+
+from __future__ import absolute_import
+import os
+import hashlib
+import logging
+import marshal
+from importlib.util import MAGIC_NUMBER
+
+
+class ManifestCodeCache(object):
+
+    """Class providing the on-disk cache of the compiled Manifest.py code,
+    marshalled like the __pycache__ files.  The code objects are keyed by
+    the hash of the executed source, i.e. the manifest content plus the
+    prefix and suffix code"""
+
+    CACHE_FILE = "manifests.marshal"
+    FORMAT = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.used = {}
+        self.modified = False
+
+    def _cache_file(self):
+        """Get the path of the file storing the cache"""
+        return os.path.join(self.cache_dir, self.CACHE_FILE)
+
+    def load(self):
+        """Load the cache content from disk, an invalid cache or one written
+        by another Python version is silently discarded"""
+        try:
+            with open(self._cache_file(), "rb") as cache_file:
+                content = marshal.load(cache_file)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return
+        if (not isinstance(content, dict)
+                or content.get("format") != self.FORMAT
+                or content.get("magic") != MAGIC_NUMBER):
+            logging.debug("Discarding outdated manifest code cache in %s",
+                          self.cache_dir)
+            return
+        self.entries = content.get("codes", {})
+
+    def save(self):
+        """Store the code compiled or used in this run, if anything new was
+        compiled.  The code of the manifests no longer used is dropped"""
+        if not self.modified:
+            return
+        content = {"format": self.FORMAT,
+                   "magic": MAGIC_NUMBER,
+                   "codes": self.used}
+        tmp_file = self._cache_file() + ".tmp"
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmp_file, "wb") as cache_file:
+                marshal.dump(content, cache_file)
+            os.replace(tmp_file, self._cache_file())
+        except (IOError, OSError) as error:
+            logging.warning("Cannot write the manifest code cache in %s: %s",
+                            self.cache_dir, error)
+            return
+        self.modified = False
+
+    def compile(self, source):
+        """Get the code object for the source, compiling it only if it is
+        not in the cache"""
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        code = self.entries.get(key)
+        if code is None:
+            code = compile(source, "<string>", "exec")
+            self.entries[key] = code
+            self.modified = True
+        self.used[key] = code
+        return code
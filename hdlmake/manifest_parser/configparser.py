@@ -26,10 +26,13 @@ from __future__ import absolute_import
 import logging
 import os
 import sys
+import threading
 if sys.version[0] != "2":
     from io import StringIO
+    from collections.abc import MutableMapping
 else:
     from StringIO import StringIO
+    from collections import MutableMapping
 import contextlib
 
 
@@ -43,6 +46,89 @@ def capture_stdout():
     sys.stdout = old
 
 
+class ManifestContext(MutableMapping):
+
+    """Copy-on-write context for the execution of a manifest, layered like
+    a collections.ChainMap: the variables set or deleted in a context are
+    kept in its own layer, over the parent context or mapping, which is
+    never modified.  A new layer is thus created in constant time.
+
+    The code is executed with all the variables as real globals, as with a
+    plain dict.  The parent layer is flattened into a dict only once, and
+    each of its children gets a shallow copy of it"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.local = {}
+        self.hidden = set()
+        self._namespace = None
+
+    def new_child(self):
+        """Get a new empty layer over this context"""
+        return ManifestContext(self)
+
+    def _parent_has(self, key):
+        """Check if the key is visible in the parent layers"""
+        return self.parent is not None and key in self.parent
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        if key in self.hidden or self.parent is None:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+        self.hidden.discard(key)
+        self._namespace = None
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.local.pop(key, None)
+        if self._parent_has(key):
+            self.hidden.add(key)
+        self._namespace = None
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+        return key not in self.hidden and self._parent_has(key)
+
+    def __iter__(self):
+        keys = set(self.local)
+        if self.parent is not None:
+            keys.update(key for key in self.parent if key not in self.hidden)
+        return iter(keys)
+
+    def __len__(self):
+        return len(set(self))
+
+    def namespace(self):
+        """Get the dict holding all the variables of this context.  It is
+        built once and must not be modified"""
+        if self._namespace is None:
+            self._namespace = dict(self)
+        return self._namespace
+
+    def exec_globals(self):
+        """Get a new dict of globals for the execution of a manifest in this
+        context: a copy of the namespace of the parent, updated with the
+        variables of this layer"""
+        if self.hidden or not isinstance(self.parent, ManifestContext):
+            return dict(self)
+        exec_globals = self.parent.namespace().copy()
+        exec_globals.update(self.local)
+        return exec_globals
+
+
+# The stdout capture and the current directory are process wide: the
+# manifests are executed one at a time, even when they are loaded by
+# several threads.
+_EXEC_LOCK = threading.Lock()
+
+
 class ConfigParser(object):
 
     """Class for parsing python configuration files
@@ -180,6 +266,10 @@ types:[<type 'int'>]
                     "Allowing a key makes sense for dictionaries only, {}".format(self.types))
             self.keys.append(key)
 
+    # These HDLMake keys must not be inherited from parent module
+    key_purge_list = ["modules", "files", "include_dirs",
+                      "inc_makefiles", "library"]
+
     def __init__(self, description=None):
         if description is not None:
             if not isinstance(description, str):
@@ -189,6 +279,11 @@ types:[<type 'int'>]
         self.prefix_code = ""
         self.suffix_code = ""
         self.config_file = None
+        self.code_cache = None
+        # Execute the configuration file from its directory
+        self.change_dir = True
+        # The output printed by the configuration file
+        self.printed = ""
 
     def __getitem__(self, name):
         if name in self.__names():
@@ -236,6 +331,10 @@ types:[<type 'int'>]
         """Add the arbitrary Python to be executed just after the Manifest"""
         self.suffix_code += code + '\n'
 
+    def set_code_cache(self, code_cache):
+        """Use the provided ManifestCodeCache to get the compiled code"""
+        self.code_cache = code_cache
+
     def __names(self):
         """A method that returns a list containing the name for every non
         empty object in the parser's option instance list"""
@@ -245,13 +344,25 @@ types:[<type 'int'>]
         """method that acts as an 'exec' wraper to run the Python code.  Return the locals"""
         options = {}
         try:
-            with capture_stdout() as stdout_aux:
-                root_path = os.getcwd()
-                exec_path = os.path.dirname(self.config_file)
-                os.chdir(exec_path)
-                exec(content, extra_context, options)
-                os.chdir(root_path)
+            # Only the exec is serialized, with the change of directory
+            if self.code_cache is not None:
+                code = self.code_cache.compile(content)
+            else:
+                code = compile(content, "<string>", "exec")
+            if isinstance(extra_context, ManifestContext):
+                extra_context = extra_context.exec_globals()
+            with _EXEC_LOCK, capture_stdout() as stdout_aux:
+                if self.change_dir:
+                    root_path = os.getcwd()
+                    os.chdir(os.path.dirname(self.config_file))
+                    try:
+                        exec(code, extra_context, options)
+                    finally:
+                        os.chdir(root_path)
+                else:
+                    exec(code, extra_context, options)
             printed = stdout_aux.getvalue()
+            self.printed = printed
             if len(printed) > 0:
                 logging.info(
                     "The manifest inside {} tried to print something:".format(
@@ -281,14 +392,12 @@ types:[<type 'int'>]
     def parse(self, config_file, extra_context=None):
         """Parse the stored manifest plus arbitrary code.  Return a dictionnary
         of variables defined in the manifest."""
-        assert isinstance(extra_context, dict) or extra_context is None
+        assert (isinstance(extra_context, (dict, ManifestContext))
+                or extra_context is None)
 
         self.config_file = config_file
 
-        # These HDLMake keys must not be inherited from parent module
-        key_purge_list = ["modules", "files", "include_dirs",
-                          "inc_makefiles", "library"]
-        for key_to_be_deleted in key_purge_list:
+        for key_to_be_deleted in self.key_purge_list:
             extra_context.pop(key_to_be_deleted, None)
         # Load the Manifest.py file content in a local variable
         content = self.__read_config_content()
@@ -88,6 +88,15 @@ class ManifestParser(ConfigParser):
              'default': None,
              'help': "Destination for fetched modules",
              'type': ''},
+            {'name': 'fetch_mirror',
+             'default': None,
+             'help': "Directory of the shared mirrors of the Git modules",
+             'type': ''},
+            {'name': 'fetch_strategy',
+             'default': None,
+             'help': "How the Git modules are fetched: full, shallow, "
+             "partial or sparse",
+             'type': ''},
             {'name': 'fetch_pre_cmd',
              'default': '',
                         'help': "Command to be executed before fetch",
@@ -30,12 +30,13 @@ specific parent modules providing specific methods and attributes.
 from __future__ import print_function
 from __future__ import absolute_import
 import os
+import shutil
 import logging
 
 from ..util import path as path_mod
-from ..util import shell
 from ..fetch import git
 from ..manifest_parser.manifestparser import ManifestParser
+from ..manifest_parser.configparser import ManifestContext
 import six
 
 
@@ -55,6 +56,16 @@ class ModuleArgs(object):
         self.source = source or 'local'
         self.fetchto = fetchto
 
+    def get_url(self):
+        """Get the URL identifying the module, i.e. the provided one but
+        the branch and the revision"""
+        if self.source == 'local':
+            return self.url
+        elif self.source == 'svn':
+            return path_mod.svn_parse(self.url)[0]
+        else:
+            return path_mod.url_parse(self.url)[0]
+
 
 class Module(object):
 
@@ -86,6 +97,9 @@ class Module(object):
         self.revision = None
         self.path = None                        # Relative path to the module.
         self.isfetched = False                  # True if the module exists on the file system.
+        self.locked_revision = None             # Revision to fetch, from hdlmake.lock.
+        self.manifest_file = None               # Path of the parsed Manifest.py
+        self.manifest_printed = False           # True if the manifest printed something.
         self.init_config(module_args)
         self.action = action
         self.module_args = module_args
@@ -155,23 +169,32 @@ class Module(object):
                     filepath + "\nOmitting.")
                 return False
             filepath = os.path.join(self.path, filepath)
-            if not os.path.exists(filepath):
+            kind = self.action.path_scanner.kind(filepath)
+            if kind is None:
                 raise Exception(
                     "Path specified in manifest {} doesn't exist: {}".format(
                     self.path, filepath))
-
-            filepath = path_mod.rel2abs(filepath, self.path)
-            if os.path.isdir(filepath):
+            if kind == "dir":
                 logging.warning(
                     "Path specified in manifest %s is a directory: %s",
-                    self.path, filepath)
+                    self.path, os.path.abspath(filepath))
         return True
 
     def _make_list_of_paths(self, list_of_paths):
-        """Get a list with only the valid absolute paths from the provided"""
+        """Get a list with only the valid absolute paths from the provided,
+        the glob patterns being replaced by the matching files"""
         paths = []
         for filepath in list_of_paths:
-            if self._check_filepath(filepath):
+            if (filepath and path_mod.has_magic(filepath)
+                    and not path_mod.is_abs_path(filepath)):
+                matches = self.action.path_scanner.glob(
+                    os.path.join(self.path, filepath))
+                if not matches:
+                    raise Exception(
+                        "Pattern specified in manifest {} doesn't match any "
+                        "file: {}".format(self.path, filepath))
+                paths.extend(os.path.abspath(match) for match in matches)
+            elif self._check_filepath(filepath):
                 paths.append(path_mod.rel2abs(filepath, self.path))
         return paths
 
@@ -180,6 +203,18 @@ class Module(object):
         Build a Source File Set containing the files indicated by the
         provided list of paths
         """
+        scanner = self.action.path_scanner
+        file_paths = []
+        for path_aux in paths:
+            if scanner.isdir(path_aux):
+                # If a path is a dir, add all the files of that dir.
+                file_paths.extend(scanner.list_files(path_aux))
+            else:
+                file_paths.append(path_aux)
+        return self.create_file_list(file_paths)
+
+    def create_file_list(self, file_paths):
+        """Build a Source File Set containing the provided files"""
         from ..sourcefiles.srcfile import create_source_file
         from ..sourcefiles.sourcefileset import SourceFileSet
         srcs = SourceFileSet()
@@ -189,22 +224,11 @@ class Module(object):
         else:
             include_dirs = self.top_manifest.manifest_dict.get(
                 'include_dirs', [])
-        for path_aux in paths:
-            if os.path.isdir(path_aux):
-                # If a path is a dir, add all the files of that dir.
-                dir_ = os.listdir(path_aux)
-                for f_dir in dir_:
-                    f_dir = os.path.join(self.path, path_aux, f_dir)
-                    if not os.path.isdir(f_dir):
-                        srcs.add(create_source_file(path=f_dir,
-                                                    module=self,
-                                                    library=self.library,
-                                                    include_dirs=include_dirs))
-            else:
-                srcs.add(create_source_file(path=path_aux,
-                                            module=self,
-                                            library=self.library,
-                                            include_dirs=include_dirs))
+        for path_aux in file_paths:
+            srcs.add(create_source_file(path=path_aux,
+                                        module=self,
+                                        library=self.library,
+                                        include_dirs=include_dirs))
         return srcs
 
     def _process_manifest_files(self):
@@ -284,8 +308,7 @@ class Module(object):
         """Delete the module dir if it is already fetched and available"""
         assert self.isfetched
         logging.debug("Removing " + self.path)
-        command_tmp = shell.rmdir_command() + " " + self.path
-        shell.run(command_tmp)
+        shutil.rmtree(self.path)
 
     def _search_for_manifest(self):
         """Look for manifest in the given folder and create a Manifest object
@@ -299,16 +322,45 @@ class Module(object):
                 self.path)
         for filename in dir_files:
             if filename == "manifest.py" or filename == "Manifest.py":
-                if not os.path.isdir(filename):
+                if not os.path.isdir(os.path.join(self.path, filename)):
                     logging.debug("Found manifest for module %s: %s",
                                   self.path, filename)
                     return os.path.join(self.path, filename)
         raise Exception("No manifest found in path: {}".format(self.path))
 
-    def parse_manifest(self):
+    def parse_manifest(self, change_dir=True):
         """
         Create a dictionary from the module Manifest.py and assign it
-        to the manifest_dict property.
+        to the manifest_dict property, then process it and parse the
+        manifests of the submodules.
+        See _load_manifest for the creation of the dictionary and the
+        meaning of change_dir.
+        """
+
+        self._parse_manifest(None, change_dir)
+
+    def _parse_manifest(self, context, change_dir=True):
+        """Parse the manifest, the provided context being the one shared by
+        the submodules of the top module (created if None)"""
+        if self.manifest_dict or self.isfetched is False:
+            return
+        if context is None and self.parent is not None:
+            context = self._submodule_context()
+        self._process_loaded_manifest(
+            self._load_manifest(context, change_dir), context, change_dir)
+
+    def _submodule_context(self):
+        """Get the context shared by the manifests of all the submodules:
+        the variables of the top manifest but the keys to be purged"""
+        top_dict = self.action.top_manifest.manifest_dict
+        context = ManifestContext(top_dict).new_child()
+        for key in ManifestParser.key_purge_list:
+            context.pop(key, None)
+        return context
+
+    def _load_manifest(self, context, change_dir=True):
+        """
+        Execute the module Manifest.py and return its dictionary.
         In order to do this, it creates a ManifestParser object and
         feeds it with:
         - the arbitrary code from action's top_module options
@@ -317,14 +369,14 @@ class Module(object):
         - the extra_context:
           - If this is the root module (has not parent),
               use an empty extra_context in the parser
-          - If this is a submodule (has a parent),
-              inherit the extra_context as:
-            - the full manifest_dict from the top_module...
-            - ...but deleting some key fields that needs to be respected.
+          - If this is a submodule (has a parent), a new layer over the
+              shared context, i.e. the top_module variables but some key
+              fields that needs to be respected (copied on write only).
+          - In any case, the module directory as __manifest.
+        The Manifest.py is executed from the module directory, unless
+        change_dir is False: the current directory is then left untouched,
+        so that the manifest can be loaded while other threads rely on it.
         """
-
-        if self.manifest_dict or self.isfetched is False:
-            return
         assert self.path is not None
 
         filename = self._search_for_manifest()
@@ -339,28 +391,53 @@ PARSE START: %s
 
         manifest_parser.add_prefix_code(self.action.options.prefix_code)
         manifest_parser.add_suffix_code(self.action.options.suffix_code)
+        manifest_parser.set_code_cache(self.action.manifest_code_cache)
+        manifest_parser.change_dir = change_dir
 
         # Parse and extract variables from it.
-        if self.parent is None:
+        if context is None:
             extra_context = {}
         else:
-            extra_context = dict(self.top_manifest.manifest_dict)
+            extra_context = context.new_child()
         extra_context["__manifest"] = self.path
 
         # The parse method is where most of the parser action takes place!
         try:
-            self.manifest_dict = manifest_parser.parse(config_file=filename, extra_context=extra_context)
+            manifest_dict = manifest_parser.parse(
+                config_file=filename, extra_context=extra_context)
         except NameError as name_error:
             raise Exception(
                 "Error while parsing {0}:\n{1}: {2}.".format(
                     self.path, type(name_error), name_error))
+        self.manifest_file = filename
+        self.manifest_printed = bool(manifest_parser.printed)
+        return manifest_dict
+
+    def load_manifest_dict(self):
+        """Execute the Manifest.py of the module and get its dictionary
+        without processing it.  It is used while fetching: with several
+        jobs, the other fetches rely on the current directory, so it is
+        then left untouched"""
+        context = None
+        if self.parent is not None:
+            context = self._submodule_context()
+        return self._load_manifest(context,
+                                   change_dir=self.action.options.jobs == 1)
+
+    def _process_loaded_manifest(self, manifest_dict, context,
+                                 change_dir=True):
+        """Assign and process the loaded manifest_dict, then parse every
+        detected submodule"""
+        self.manifest_dict = manifest_dict
 
         # Process the parsed manifest_dict to assign the module properties
         self.process_manifest()
 
         # Recurse: parse every detected submodule
+        if context is None:
+            context = self._submodule_context()
         for submod in self.submodules():
-            submod.parse_manifest()
+            submod._parse_manifest(context, change_dir)
 
         logging.debug("""
 ***********************************************************
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Module providing the persistent snapshot of the resolved module pool"""
+
+from __future__ import absolute_import
+import os
+import contextlib
+import hashlib
+import logging
+import pickle
+
+from .module import Module, ModuleArgs
+from ..util import path as path_mod
+from ..sourcefiles.parse_cache import file_signature, signature_matches
+from .._version import __version__
+
+
+def dir_signature(path):
+    """Get the [mtime, listing hash] signature of the given directory"""
+    stat = os.stat(path)
+    listing = "\n".join(sorted(os.listdir(path)))
+    return [stat.st_mtime, hashlib.sha1(listing.encode("utf-8")).hexdigest()]
+
+
+def _dir_signature_matches(path, signature):
+    """Check if the directory in path still has the given signature.  As for
+    the files, the listing is only hashed again if the mtime doesn't match"""
+    try:
+        if os.stat(path).st_mtime == signature[0]:
+            return True
+        return dir_signature(path)[1] == signature[1]
+    except OSError:
+        return False
+
+
+def _picklable_dict(manifest_dict):
+    """Get a copy of the manifest dictionary without the values that cannot
+    be pickled"""
+    if manifest_dict is None:
+        return None
+    picklable = {}
+    for key, value in manifest_dict.items():
+        try:
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            logging.debug("Not storing the manifest variable %s", key)
+            continue
+        picklable[key] = value
+    return picklable
+
+
+class _WarningRecorder(logging.Handler):
+
+    """Logging handler keeping the warnings emitted while parsing the pool,
+    so that they are emitted again when the snapshot is restored"""
+
+    # The record attributes that are kept in the snapshot
+    FIELDS = ["name", "levelno", "levelname", "pathname", "filename",
+              "module", "lineno", "funcName"]
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        fields = dict((field, getattr(record, field))
+                      for field in self.FIELDS)
+        fields["msg"] = record.getMessage()
+        self.records.append(fields)
+
+
+class PoolCache(object):
+
+    """Class providing the on-disk snapshot of the module pool, i.e. the
+    module tree with the manifest dictionaries and the file lists, so that
+    the manifests are not executed again when nothing has changed.
+
+    The snapshot is only valid for the same Manifest.py files, the same
+    content in the directories listed or walked by the glob patterns in
+    'files' and the same prefix and suffix code: the files read or imported
+    by the manifests are not tracked, so it is only used on request.  It is
+    not stored if a manifest printed something.  The manifest variables
+    that cannot be pickled, e.g. the imported modules and the functions,
+    are left out.  The warnings emitted while processing the manifests are
+    emitted again when it is restored"""
+
+    CACHE_FILE = "pool.pickle"
+    FORMAT = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.warnings = []
+
+    def _cache_file(self):
+        """Get the path of the file storing the cache"""
+        return os.path.join(self.cache_dir, self.CACHE_FILE)
+
+    @staticmethod
+    def _key(action):
+        """Get the part of the key given by the command line"""
+        return {"format": PoolCache.FORMAT,
+                "version": __version__,
+                "cwd": os.getcwd(),
+                "prefix_code": action.options.prefix_code,
+                "suffix_code": action.options.suffix_code,
+                "warnings": logging.getLogger().isEnabledFor(logging.WARNING)}
+
+    def _load_content(self, action):
+        """Load the snapshot from disk, None if invalid or outdated"""
+        try:
+            with open(self._cache_file(), "rb") as cache_file:
+                content = pickle.load(cache_file)
+        except Exception:
+            return None
+        if not isinstance(content, dict) or content.get("key") != \
+                self._key(action):
+            return None
+        for path, signature in content["manifests"].items():
+            if not signature_matches(path, signature):
+                logging.debug("Manifest changed: %s", path)
+                return None
+        for path, signature in content["dirs"].items():
+            if not _dir_signature_matches(path, signature):
+                logging.debug("Directory changed: %s", path)
+                return None
+        for path in content["paths"]:
+            if not os.path.exists(path):
+                return None
+        return content
+
+    def restore(self, action):
+        """Fill the pool of the action, whose top module is already built,
+        from the snapshot.  Return False if there is no valid snapshot, so
+        the manifests must be parsed"""
+        content = self._load_content(action)
+        if content is None:
+            return False
+        entries = content["modules"]
+        top = action.top_manifest
+        if entries[0]["url"] != top.url:
+            return False
+        modules = [top]
+        for entry in entries[1:]:
+            args = ModuleArgs()
+            args.set_args(modules[entry["parent"]], entry["url"],
+                          entry["source"], entry["fetchto"])
+            module = Module(args, action)
+            if module.isfetched != entry["isfetched"]:
+                logging.debug("Fetch state changed: %s", module.url)
+                return False
+            modules.append(module)
+        for module, entry in zip(modules, entries):
+            module.manifest_dict = entry["manifest_dict"]
+        for module, entry in zip(modules, entries):
+            if entry["files"] is None:
+                continue
+            module.manifest_file = entry["manifest_file"]
+            module.library = entry["library"]
+            module.incl_makefiles = entry["incl_makefiles"]
+            module.modules = dict(
+                (kind, [modules[index] for index in indexes])
+                for kind, indexes in entry["modules"].items())
+            module.files = module.create_file_list(entry["files"])
+        action.manifests = modules
+        action.index_manifests()
+        logging.debug("Module pool restored from %s", self.cache_dir)
+        for fields in content["warnings"]:
+            logger = logging.getLogger(fields["name"])
+            if logger.isEnabledFor(fields["levelno"]):
+                logger.handle(logging.makeLogRecord(fields))
+        return True
+
+    @contextlib.contextmanager
+    def record_warnings(self):
+        """Keep the warnings emitted in the context, to be stored"""
+        recorder = _WarningRecorder()
+        root_logger = logging.getLogger()
+        root_logger.addHandler(recorder)
+        try:
+            yield
+        finally:
+            root_logger.removeHandler(recorder)
+        self.warnings = recorder.records
+
+    def store(self, action):
+        """Store the snapshot of the freshly parsed pool of the action"""
+        modules = action.manifests
+        indexes = dict((id(module), index)
+                       for index, module in enumerate(modules))
+        manifests = {}
+        dirs = dict((dir_path, dir_signature(dir_path))
+                    for dir_path in action.path_scanner.walked)
+        paths = []
+        entries = []
+        for module in modules:
+            if module.manifest_printed:
+                logging.info("Not storing the module pool: %s printed "
+                             "something", module.manifest_file)
+                return
+            entry = {"url": module.module_args.url,
+                     "source": module.module_args.source,
+                     "fetchto": module.module_args.fetchto,
+                     "parent": indexes.get(id(module.parent)),
+                     "isfetched": module.isfetched,
+                     "manifest_dict": _picklable_dict(module.manifest_dict),
+                     "files": None}
+            entries.append(entry)
+            if module.files is None:
+                continue
+            manifests[module.manifest_file] = file_signature(
+                module.manifest_file)
+            # The directories and glob patterns are checked from the walked
+            # directories, the single files must only exist.  A pattern that
+            # is the name of an existing file is such a single file
+            files = set(file_aux.path for file_aux in module.files)
+            for filepath in module.manifest_dict.get("files", []):
+                if not filepath or path_mod.is_abs_path(filepath):
+                    continue
+                pattern = path_mod.has_magic(filepath)
+                filepath = os.path.join(module.path, filepath)
+                if pattern:
+                    if os.path.abspath(filepath) in files:
+                        paths.append(filepath)
+                elif not action.path_scanner.isdir(filepath):
+                    paths.append(filepath)
+            paths.extend(module.incl_makefiles)
+            entry.update({
+                "manifest_file": module.manifest_file,
+                "library": module.library,
+                "incl_makefiles": module.incl_makefiles,
+                "modules": dict(
+                    (kind, [indexes[id(submod)] for submod in submods])
+                    for kind, submods in module.modules.items()),
+                "files": sorted(file_aux.path for file_aux in module.files)})
+        content = {"key": self._key(action),
+                   "manifests": manifests,
+                   "dirs": dirs,
+                   "paths": paths,
+                   "modules": entries,
+                   "warnings": self.warnings}
+        try:
+            data = pickle.dumps(content, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            logging.info("Not storing the module pool: %s", error)
+            return
+        tmp_file = self._cache_file() + ".tmp"
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmp_file, "wb") as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_file, self._cache_file())
+        except (IOError, OSError) as error:
+            logging.warning("Cannot write the module pool cache in %s: %s",
+                            self.cache_dir, error)
@@ -24,7 +24,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import os
-import logging
+import weakref
 
 from ..util import path as path_mod
 import six
@@ -32,7 +32,12 @@ import six
 
 class DepRelation(object):
 
-    """Class used to create instances representing HDL dependency relations"""
+    """Class used to create instances representing HDL dependency relations.
+
+    The relations are immutable and interned: creating a relation equal to
+    an existing one returns the same instance, so that two relations are
+    equal only if they are the same object, and their hash is computed
+    once"""
 
     # rel_type
     # Architecture is never required.
@@ -41,21 +46,47 @@ class DepRelation(object):
     ARCHITECTURE = 3
     MODULE = ENTITY
 
-    def __init__(self, obj_name, lib_name, rel_type):
+    __slots__ = ("rel_type", "obj_name", "lib_name", "key", "_hash",
+                 "__weakref__")
+
+    # The interned instances, by key.  An instance only lives as long as a
+    # file or a caller refers to it, so the dictionary doesn't keep growing
+    _instances = weakref.WeakValueDictionary()
+
+    def __new__(cls, obj_name, lib_name, rel_type):
         assert rel_type in [
             DepRelation.ENTITY,
             DepRelation.PACKAGE,
             DepRelation.ARCHITECTURE,
             DepRelation.MODULE]
-        self.rel_type = rel_type
-        self.obj_name = obj_name.lower()
-        self.lib_name = None if lib_name is None else lib_name.lower()
+        obj_name = obj_name.lower()
+        lib_name = None if lib_name is None else lib_name.lower()
+        # Tuple identifying the relation, used to index the providers
+        key = (rel_type, lib_name, obj_name)
+        instance = cls._instances.get(key)
+        if instance is None:
+            instance = object.__new__(cls)
+            for name, value in (("rel_type", rel_type),
+                                ("obj_name", obj_name),
+                                ("lib_name", lib_name),
+                                ("key", key),
+                                ("_hash", hash(key))):
+                object.__setattr__(instance, name, value)
+            instance = cls._instances.setdefault(key, instance)
+        return instance
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DepRelation instances are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("DepRelation instances are immutable")
+
+    def __reduce__(self):
+        return (DepRelation, (self.obj_name, self.lib_name, self.rel_type))
 
     def satisfies(self, rel_b):
         """Check if the current dependency relation matches the provided one"""
-        return (rel_b.rel_type == self.rel_type 
-                and rel_b.obj_name == self.obj_name
-                and rel_b.lib_name == self.lib_name)
+        return rel_b is self
 
     def __repr__(self):
         ostr = {
@@ -68,20 +99,30 @@ class DepRelation(object):
                                self.obj_name)
 
     def __hash__(self):
-        return hash(self.__repr__())
+        return self._hash
+
 
-    def __eq__(self, other):
-        return (isinstance(other, self.__class__)
-                and self.__dict__ == other.__dict__)
+def _lazy_set(slot):
+    """Get a property for the set stored in the given slot, which is only
+    created when first accessed"""
+    def _get(self):
+        value = getattr(self, slot)
+        if value is None:
+            value = set()
+            setattr(self, slot, value)
+        return value
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+    def _set(self, value):
+        setattr(self, slot, value)
+    return property(_get, _set)
 
 
 class File(object):
 
     """This is the base class for all of the different files in HDLMake"""
 
+    __slots__ = ("path", "module")
+
     def __init__(self, path, module=None):
         self.path = path
         assert not isinstance(module, six.string_types)
@@ -130,18 +171,27 @@ class DepFile(File):
 
     """Class that serves as base to all those HDL files that can be
     parsed and solved (Verilog, SystemVerilog, VHDL).  Inherit from
-    File but also provides dependencies"""
+    File but also provides dependencies.  The sets of relations and files
+    are only created when needed"""
+
+    __slots__ = ("_provides", "_requires", "_depends_on", "_included_files",
+                 "dep_level", "is_parsed")
 
     def __init__(self, path, module):
         assert isinstance(path, six.string_types)
         File.__init__(self, path=path, module=module)
-        self.provides = set()
-        self.requires = set()
-        self.depends_on = set()     # Set of files this file depends on.
-        self.included_files = set()
+        self._provides = None
+        self._requires = None
+        self._depends_on = None     # Set of files this file depends on.
+        self._included_files = None
         self.dep_level = None
         self.is_parsed = False
 
+    provides = _lazy_set("_provides")
+    requires = _lazy_set("_requires")
+    depends_on = _lazy_set("_depends_on")
+    included_files = _lazy_set("_included_files")
+
     def add_require(self, rel):
         """Add dependency :param rel:"""
         self.requires.add(rel)
@@ -155,26 +205,12 @@ class DepFile(File):
         listed in the parameter (rel_b)"""
         assert isinstance(rel_b, DepRelation)
         # self._parse_if_needed()
-        return any([x.satisfies(rel_b) for x in self.provides])
+        return rel_b in self.provides
 
     def get_dep_level(self):
         """Get the dependency level for the file instance, so we can order
         later the full fileset"""
         if self.dep_level is None:
-            if len(self.depends_on) == 0:
-                self.dep_level = 0
-            else:
-                # set dep_level to a negative value so we can detect
-                # if the recusion below brings us back to
-                # this file in a circular reference, that would otherwise
-                # result in an infinite loop.
-                self.dep_level = -1
-                # recurse, to find the largest number of levels below.
-                self.dep_level = 1 + \
-                    max([dep.get_dep_level() for dep in self.depends_on])
-        elif self.dep_level < 0:
-            logging.warning("Probably run into a circular reference of file "
-                            "dependencies. It appears %s depends on itself, "
-                            "indirectly via atleast one other file.",
-                            self.path)
+            from .new_dep_solver import compute_dep_levels
+            compute_dep_levels([self])
         return self.dep_level
@@ -32,48 +32,134 @@ from ..sourcefiles.dep_file import DepFile
 
 class DepParser(object):
 
-    """Base Class for the different HDL parsers (VHDL and Verilog)"""
-
-    def __init__(self, dep_file):
-        self.dep_file = dep_file
+    """Base Class for the different HDL parsers (VHDL and Verilog).  A
+    single parser instance is shared by all of the files of a language,
+    so that a parser must not keep any state from a parsed file"""
 
     def parse(self, dep_file):
         """Base dummy interface method for the HDL parse execution"""
         pass
 
 
-def solve(fileset, standard_libs=None):
+def _build_provider_index(fset):
+    """Build a dictionary that maps every provided relation key, i.e.
+    (rel_type, lib_name, obj_name), to the set of files providing it"""
+    provider_index = {}
+    for dep_file in fset:
+        for rel in dep_file.provides:
+            provider_index.setdefault(rel.key, set()).add(dep_file)
+    return provider_index
+
+
+def _parse_worker(file_class, path, library, include_dirs):
+    """Parse a single file in a worker process.  Only plain tuples are
+    returned, so that the relations can be merged back in the original
+    file objects: (provides, requires, included_files)"""
+    from .vlog_parser import IncludeCache
+    if IncludeCache.current is None:
+        # The worker lives as long as the pool, i.e. for this run only.
+        IncludeCache.current = IncludeCache()
+    dep_file = file_class(path=path, module=None, library=library)
+    if include_dirs is not None:
+        dep_file.include_dirs = include_dirs
+    dep_file.parser.parse(dep_file)
+    return ([(rel.obj_name, rel.lib_name, rel.rel_type)
+             for rel in dep_file.provides],
+            [(rel.obj_name, rel.lib_name, rel.rel_type)
+             for rel in dep_file.requires],
+            sorted(dep_file.included_files))
+
+
+def _parse_parallel(file_list, jobs):
+    """Parse the files in file_list using a pool of jobs processes"""
+    from concurrent.futures import ProcessPoolExecutor
+    from .dep_file import DepRelation
+    args = [(type(dep_file), dep_file.path, dep_file.library,
+             getattr(dep_file, "include_dirs", None))
+            for dep_file in file_list]
+    chunksize = max(1, len(file_list) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # map() returns the results in the order of file_list, whatever
+        # the worker that parsed each one of the files.
+        results = executor.map(_parse_worker, *zip(*args),
+                               chunksize=chunksize)
+        for dep_file, result in zip(file_list, results):
+            provides, requires, included_files = result
+            for rel in provides:
+                dep_file.add_provide(DepRelation(*rel))
+            for rel in requires:
+                dep_file.add_require(DepRelation(*rel))
+            dep_file.included_files = set(included_files)
+            dep_file.is_parsed = True
+
+
+def _parse_files(fset, parse_cache, jobs):
+    """Parse all the files in fset that are not parsed yet, nor available
+    in the parse_cache, using up to jobs processes"""
+    to_parse = []
+    for investigated_file in fset.sort():
+        logging.debug("INVESTIGATED FILE: %s", investigated_file)
+        if investigated_file.is_parsed:
+            continue
+        if parse_cache is not None and parse_cache.restore(investigated_file):
+            continue
+        to_parse.append(investigated_file)
+    if jobs > 1 and len(to_parse) > 1:
+        logging.debug("Parsing %d files using %d jobs", len(to_parse), jobs)
+        _parse_parallel(to_parse, jobs)
+    else:
+        for investigated_file in to_parse:
+            logging.debug("Not parsed yet, let's go!")
+            investigated_file.parser.parse(investigated_file)
+    if parse_cache is not None:
+        for investigated_file in to_parse:
+            parse_cache.store(investigated_file)
+        parse_cache.save()
+
+
+def solve(fileset, standard_libs=None, cache_dir=None, jobs=1,
+          strict_cycles=False):
     """Function that Parses and Solves the provided HDL fileset. Note
-       that it doesn't return a new fileset, but modifies the original one"""
+       that it doesn't return a new fileset, but modifies the original one.
+       If cache_dir is provided, the relations of the files that didn't
+       change since the previous run are taken from the parse cache.  The
+       files are parsed by a pool of processes if jobs is greater than 1.
+       Circular dependencies are reported, and are errors if strict_cycles.
+       The Verilog include files are read once for all the parsed files"""
     from .sourcefileset import SourceFileSet
     from .dep_file import DepRelation
+    from .parse_cache import ParseCache
+    from .vlog_parser import IncludeCache
     assert isinstance(fileset, SourceFileSet)
     fset = fileset.filter(DepFile)
     # print(fileset)
     # print(fset)
+    parse_cache = None
+    if cache_dir is not None:
+        parse_cache = ParseCache(cache_dir)
+        parse_cache.load()
     logging.debug("PARSE BEGIN: Here, we will parse all the files in the "
                   "fileset: no parsing should be done beyond this point")
-    for investigated_file in fset:
-        logging.debug("INVESTIGATED FILE: %s", investigated_file)
-        if not investigated_file.is_parsed:
-            logging.debug("Not parsed yet, let's go!")
-            investigated_file.parser.parse(investigated_file)
+    with IncludeCache.activate():
+        _parse_files(fset, parse_cache, jobs)
     logging.debug("PARSE END: now the parsing is done")
 
     logging.debug("SOLVE BEGIN")
+    # The links are not kept in the parse cache: with the relations of the
+    # unchanged files restored, building the index and linking all of them
+    # again is a small part of the run
+    provider_index = _build_provider_index(fset)
     not_satisfied = 0
     for investigated_file in fset:
         # logging.info("INVESTIGATED FILE: %s" % investigated_file)
         for rel in investigated_file.requires:
             # logging.info("- relation: %s" % rel)
             # Only analyze USE relations, we are looking for dependencies
-            satisfied_by = set()
-            for dep_file in fset:
-                if dep_file.satisfies(rel):
-                    if dep_file is not investigated_file:
-                        # A file cannot depends on itself.
-                        investigated_file.depends_on.add(dep_file)
-                    satisfied_by.add(dep_file)
+            satisfied_by = provider_index.get(rel.key, set())
+            for dep_file in satisfied_by:
+                if dep_file is not investigated_file:
+                    # A file cannot depends on itself.
+                    investigated_file.depends_on.add(dep_file)
             if len(satisfied_by) > 1:
                 logging.warning(
                     "Relation %s satisfied by multiple (%d) files:\n %s",
@@ -97,6 +183,7 @@ def solve(fileset, standard_libs=None):
                                     "any source file",
                                     str(rel), investigated_file.name)
                     not_satisfied += 1
+    _report_cycles(fset, provider_index, strict_cycles)
     logging.debug("SOLVE END")
     if not_satisfied != 0:
         logging.warning(
@@ -107,16 +194,110 @@ def solve(fileset, standard_libs=None):
             "Dependencies solved, all of the relations were satisfied!")
 
 
+def find_strongly_connected(dep_files):
+    """Get the strongly connected components of the graph of dependencies
+    reachable from dep_files, using an iterative version of the Tarjan
+    algorithm.  Every component is a list of files sorted by path, and the
+    components are returned dependencies first"""
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in dep_files:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(root.depends_on))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(child.depends_on)))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                # All the dependencies of node have been visited.
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member is node:
+                            break
+                    component.sort(key=lambda f: f.path)
+                    components.append(component)
+    return components
+
+
+def _report_cycles(fset, provider_index, strict_cycles):
+    """Report every circular dependency in the fileset, together with the
+    relations that close the loop.  Raise an error if strict_cycles"""
+    cycles = [component for component in find_strongly_connected(fset.sort())
+              if len(component) > 1]
+    cycles.sort(key=lambda component: component[0].path)
+    for component in cycles:
+        members = set(component)
+        lines = []
+        for dep_file in component:
+            relations = [str(rel) for rel in dep_file.requires
+                         if provider_index.get(rel.key, set()) & members
+                         - set([dep_file])]
+            lines.append("%s (%s)" % (dep_file.path,
+                                      ", ".join(sorted(relations))))
+        logging.warning("Circular dependency between %d files:\n %s",
+                        len(component), "\n ".join(lines))
+    if cycles and strict_cycles:
+        raise Exception("Found {} circular dependencies in the fileset "
+                        "(--strict-cycles)".format(len(cycles)))
+
+
+def compute_dep_levels(dep_files):
+    """Set the dependency level of the provided files and of all the files
+    they depend on: 0 for a file without dependencies, or else 1 plus the
+    highest level among its dependencies.  The files in a circular
+    dependency are collapsed in a single unit sharing the same level.
+    The walk is iterative and linear in the size of the graph.  Return the
+    list of strongly connected components, dependencies first"""
+    components = find_strongly_connected(dep_files)
+    for component in components:
+        if component[0].dep_level is not None:
+            continue
+        members = set(component)
+        solved_levels = [dep.dep_level for dep_file in component
+                         for dep in dep_file.depends_on
+                         if dep not in members]
+        dep_level = 1 + max(solved_levels) if solved_levels else 0
+        for dep_file in component:
+            dep_file.dep_level = dep_level
+    return components
+
+
 def make_dependency_sorted_list(fileset):
     """Sort files in order of dependency.
     Files with no dependencies first.
-    All files that another depends on will be earlier in the list."""
+    All files that another depends on will be earlier in the list.
+    The files in a circular dependency are kept together."""
     dependable = [f for f in fileset if isinstance(f, DepFile)]
     non_dependable = [f for f in fileset if not isinstance(f, DepFile)]
-    dependable.sort(key=lambda f: f.path.lower())
-    # Not necessary, but will tend to group files more nicely
-    # in the output.
-    dependable.sort(key=DepFile.get_dep_level)
+    sort_key = {}
+    for component in compute_dep_levels(dependable):
+        unit = min(f.path.lower() for f in component)
+        for dep_file in component:
+            sort_key[dep_file] = (dep_file.dep_level, unit,
+                                  dep_file.path.lower())
+    dependable.sort(key=sort_key.get)
     return non_dependable + dependable
 
 
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Module providing the persistent cache for the parsed HDL relations"""
+
+from __future__ import absolute_import
+import os
+import json
+import hashlib
+import logging
+
+from .dep_file import DepRelation
+from .._version import __version__
+
+
+def file_signature(path):
+    """Get the [size, mtime, content hash] signature of the given file"""
+    stat = os.stat(path)
+    with open(path, "rb") as file_aux:
+        digest = hashlib.sha1(file_aux.read()).hexdigest()
+    return [stat.st_size, stat.st_mtime, digest]
+
+
+def signature_matches(path, signature):
+    """Check if the file in path still has the given signature.  The content
+    hash is only computed when the size and mtime don't match: a touched
+    but unchanged file is still considered as valid"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    size, mtime, digest = signature
+    if stat.st_size != size:
+        return False
+    if stat.st_mtime == mtime:
+        return True
+    return file_signature(path)[2] == digest
+
+
+class ParseCache(object):
+
+    """Class providing the on-disk cache of the relations found by the
+    HDL parsers, so that unchanged files are not parsed again.  A file
+    including a changed Verilog header is parsed again"""
+
+    CACHE_FILE = "parse.json"
+    FORMAT = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.modified = False
+        # The signatures checked or computed in this run, an include file
+        # is checked once whatever the number of files including it
+        self._checked = {}
+        self._signatures = {}
+
+    def _cache_file(self):
+        """Get the path of the file storing the cache"""
+        return os.path.join(self.cache_dir, self.CACHE_FILE)
+
+    def load(self):
+        """Load the cache content from disk, an invalid or outdated cache
+        is silently discarded"""
+        try:
+            with open(self._cache_file(), "r") as cache_file:
+                content = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return
+        if (content.get("format") != self.FORMAT
+                or content.get("version") != __version__):
+            logging.debug("Discarding outdated parse cache in %s",
+                          self.cache_dir)
+            return
+        self.entries = content.get("files", {})
+
+    def save(self):
+        """Store the cache content on disk if it was modified"""
+        if not self.modified:
+            return
+        content = {"format": self.FORMAT,
+                   "version": __version__,
+                   "files": self.entries}
+        tmp_file = self._cache_file() + ".tmp"
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmp_file, "w") as cache_file:
+                json.dump(content, cache_file)
+            os.replace(tmp_file, self._cache_file())
+        except (IOError, OSError) as error:
+            logging.warning("Cannot write the parse cache in %s: %s",
+                            self.cache_dir, error)
+            return
+        self.modified = False
+
+    @staticmethod
+    def _include_dirs(dep_file):
+        """Get the include search path of the file, if any"""
+        return list(getattr(dep_file, "include_dirs", []))
+
+    def _signature_matches(self, path, signature):
+        """Check the signature of path, once per run"""
+        key = (path, tuple(signature))
+        if key not in self._checked:
+            self._checked[key] = signature_matches(path, signature)
+        return self._checked[key]
+
+    def _file_signature(self, path):
+        """Compute the signature of path, once per run"""
+        if path not in self._signatures:
+            self._signatures[path] = file_signature(path)
+        return self._signatures[path]
+
+    def restore(self, dep_file):
+        """Fill the relations of dep_file from the cache.  Return False if
+        there is no valid entry for the file, so it must be parsed"""
+        entry = self.entries.get(dep_file.path)
+        if entry is None:
+            return False
+        if (entry["library"] != dep_file.library
+                or entry["include_dirs"] != self._include_dirs(dep_file)
+                or not self._signature_matches(dep_file.path,
+                                               entry["signature"])):
+            return False
+        for included_path, signature in entry["included_files"].items():
+            if not self._signature_matches(included_path, signature):
+                logging.debug("%s changed, included by %s",
+                              included_path, dep_file.path)
+                return False
+        for rel in entry["provides"]:
+            dep_file.add_provide(DepRelation(*rel))
+        for rel in entry["requires"]:
+            dep_file.add_require(DepRelation(*rel))
+        dep_file.included_files = set(entry["included_files"])
+        dep_file.is_parsed = True
+        logging.debug("Parse cache hit for %s", dep_file.path)
+        return True
+
+    def store(self, dep_file):
+        """Add the relations of the freshly parsed dep_file to the cache"""
+        assert dep_file.is_parsed
+
+        def _rel_list(relations):
+            """Convert the relations into sorted JSON friendly lists"""
+            return [[rel.obj_name, rel.lib_name, rel.rel_type]
+                    for rel in sorted(relations, key=str)]
+
+        self.entries[dep_file.path] = {
+            "library": dep_file.library,
+            "include_dirs": self._include_dirs(dep_file),
+            "signature": self._file_signature(dep_file.path),
+            "included_files": dict(
+                (path, self._file_signature(path))
+                for path in dep_file.included_files),
+            "provides": _rel_list(dep_file.provides),
+            "requires": _rel_list(dep_file.requires)}
+        self.modified = True
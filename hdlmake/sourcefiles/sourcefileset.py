@@ -25,11 +25,39 @@ class SourceFileSet(set):
 
     """Class providing a extension of the 'set' object that includes
     methods that allow for an easier management of a collection of HDL
-    source files"""
+    source files.
+
+    The files are also kept in buckets by class, so that filter only
+    visits the classes.  The filtered sets and the sorted list are cached
+    until the set is modified"""
 
     def __init__(self):
         super(SourceFileSet, self).__init__()
-        self = []
+        self._buckets = {}
+        self._filtered = {}
+        self._sorted = None
+        # A cached filtered set is shared, it cannot be modified
+        self._read_only = False
+
+    def _check_writable(self):
+        """Raise a TypeError if the set is a read-only view"""
+        if self._read_only:
+            raise TypeError("A filtered SourceFileSet cannot be modified")
+
+    def _modified(self):
+        """Drop the cached views after a modification"""
+        if self._filtered:
+            self._filtered = {}
+        self._sorted = None
+
+    def _add_file(self, file_aux):
+        """Add a single file to the set and to the bucket of its class"""
+        self._check_writable()
+        if file_aux in self:
+            return
+        super(SourceFileSet, self).add(file_aux)
+        self._buckets.setdefault(type(file_aux), set()).add(file_aux)
+        self._modified()
 
     def add(self, files):
         """Add a set of files to the source fileset instance"""
@@ -38,22 +66,103 @@ class SourceFileSet(set):
             return
         if isinstance(files, (SourceFileSet, set)):
             for file_aux in files:
-                super(SourceFileSet, self).add(file_aux)
+                self._add_file(file_aux)
         else:
             assert isinstance(files, File)
-            super(SourceFileSet, self).add(files)
+            self._add_file(files)
+
+    def update(self, *others):
+        """Add the files of every provided iterable"""
+        for files in others:
+            for file_aux in files:
+                self._add_file(file_aux)
+
+    def discard(self, file_aux):
+        """Remove the file from the set, if present"""
+        self._check_writable()
+        if file_aux in self:
+            super(SourceFileSet, self).discard(file_aux)
+            bucket = self._buckets[type(file_aux)]
+            bucket.discard(file_aux)
+            if not bucket:
+                del self._buckets[type(file_aux)]
+            self._modified()
+
+    def remove(self, file_aux):
+        """Remove the file from the set, raise KeyError if not present"""
+        if file_aux not in self:
+            raise KeyError(file_aux)
+        self.discard(file_aux)
+
+    def pop(self):
+        """Remove and return an arbitrary file from the set"""
+        file_aux = next(iter(self))
+        self.discard(file_aux)
+        return file_aux
+
+    def clear(self):
+        """Remove all of the files from the set"""
+        self._check_writable()
+        super(SourceFileSet, self).clear()
+        self._buckets = {}
+        self._modified()
+
+    def _reindex(self):
+        """Rebuild the buckets from the content of the set"""
+        self._buckets = {}
+        for file_aux in self:
+            self._buckets.setdefault(type(file_aux), set()).add(file_aux)
+        self._modified()
+
+    def difference_update(self, *others):
+        self._check_writable()
+        super(SourceFileSet, self).difference_update(*others)
+        self._reindex()
+
+    def intersection_update(self, *others):
+        self._check_writable()
+        super(SourceFileSet, self).intersection_update(*others)
+        self._reindex()
+
+    def symmetric_difference_update(self, other):
+        self._check_writable()
+        super(SourceFileSet, self).symmetric_difference_update(other)
+        self._reindex()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
 
     def filter(self, filetype):
         """Method that filters and returns all of the HDL source files
-        contained in the instance SourceFileSet matching the provided type"""
-        out = SourceFileSet()
-        for file_aux in self:
-            if isinstance(file_aux, filetype):
-                out.add(file_aux)
+        contained in the instance SourceFileSet matching the provided type.
+        The returned set is shared until this one is modified, it is read
+        only: modifying it raises a TypeError"""
+        out = self._filtered.get(filetype)
+        if out is None:
+            out = SourceFileSet()
+            for file_class, bucket in self._buckets.items():
+                if issubclass(file_class, filetype):
+                    out.add(bucket)
+            out._read_only = True
+            self._filtered[filetype] = out
         return out
 
     def sort(self):
         """Return a sorted list of the fileset.  This is useful to have always
         the same output"""
-        return sorted(self, key=(lambda x: x.path))
-
+        if self._sorted is None:
+            self._sorted = sorted(self, key=(lambda x: x.path))
+        return list(self._sorted)
@@ -33,12 +33,39 @@ from .dep_file import DepFile, File
 import six
 
 
+# The parser instances, a single one for all of the files of a language
+_PARSERS = {}
+
+# The include_dirs tuples, shared by the files of a module in the same dir.
+# The dir is made relative to the current directory, which is in the key.
+_INCLUDE_DIRS = {}
+
+
+def _shared_parser(parser_class):
+    """Get the parser instance shared by all of the files of a language"""
+    parser = _PARSERS.get(parser_class)
+    if parser is None:
+        parser = _PARSERS[parser_class] = parser_class()
+    return parser
+
+
+def _shared_include_dirs(include_dirs, dirname):
+    """Get the interned tuple of the include_dirs plus the file dirname"""
+    key = (tuple(path_mod.flatten_list(include_dirs)), dirname, os.getcwd())
+    shared = _INCLUDE_DIRS.get(key)
+    if shared is None:
+        shared = _INCLUDE_DIRS[key] = key[0] + (path_mod.relpath(dirname),)
+    return shared
+
+
 class SourceFile(DepFile):
 
     """This is a class acting as a base for the different
     HDL sources files, i.e. those that can be parsed"""
 
-    def __init__(self, path, module, library):
+    __slots__ = ("library",)
+
+    def __init__(self, path, module, library=None):
         assert isinstance(path, six.string_types)
         self.library = library or "work"
         DepFile.__init__(self, path=path, module=module)
@@ -53,27 +80,35 @@ class VHDLFile(SourceFile):
 
     """This is the class providing the generic VHDL file"""
 
-    def __init__(self, path, module, library=None):
-        SourceFile.__init__(self, path=path, module=module, library=library)
+    __slots__ = ()
+
+    @property
+    def parser(self):
+        """The parser shared by all of the VHDL files"""
         from .vhdl_parser import VHDLParser
-        self.parser = VHDLParser(self)
+        return _shared_parser(VHDLParser)
 
 
 class VerilogFile(SourceFile):
 
     """This is the class providing the generic Verilog file"""
 
+    __slots__ = ("include_dirs",)
+
     def __init__(self, path, module, library=None, include_dirs=None):
         SourceFile.__init__(self, path=path, module=module, library=library)
+        self.include_dirs = _shared_include_dirs(include_dirs, self.dirname)
+
+    @property
+    def parser(self):
+        """The parser shared by all of the Verilog files"""
         from .vlog_parser import VerilogParser
-        self.include_dirs = include_dirs[:] if include_dirs else []
-        self.include_dirs.append(path_mod.relpath(self.dirname))
-        self.parser = VerilogParser(self)
+        return _shared_parser(VerilogParser)
 
 
 class SVFile(VerilogFile):
     """This is the class providing the generic SystemVerilog file"""
-    pass
+    __slots__ = ()
 
 
 # TCL COMMAND FILE
@@ -174,10 +209,13 @@ class VEOFile(File):
 class XCIFile(SourceFile):
     """Xilinx Core IP File"""
 
-    def __init__(self, path, module, library=None):
-        SourceFile.__init__(self, path=path, module=module, library=library)
+    __slots__ = ()
+
+    @property
+    def parser(self):
+        """The parser shared by all of the XCI files"""
         from .xci_parser import XCIParser
-        self.parser = XCIParser(self)
+        return _shared_parser(XCIParser)
 
 XILINX_FILE_DICT = {
     'xise': XISEFile,
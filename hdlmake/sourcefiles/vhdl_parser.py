@@ -30,16 +30,77 @@ import re
 from .new_dep_solver import DepParser
 
 
+# The VHDL constructs recognized by the parser, all of them starting at the
+# beginning of a line.  They are combined in a single scanner, in order of
+# priority: when two of them start at the same position, the first one wins.
+# Some constructs are only matched to skip them, so that their content is
+# not mistaken for an instantiation.
+_VHDL_CONSTRUCTS = [
+    ("use",
+     r"use\s+(?P<use_lib>\w+)\s*\.\s*(?P<use_pkg>\w+)"),
+    ("entity",
+     r"entity\s+(?P<ent_name>\w+)\s+is\s+(?:port|generic|end)"
+     r".*?(?:(?P=ent_name)|entity)\s*;"),
+    ("architecture",
+     r"architecture\s+(?P<arch_name>\w+)\s+of\s+(?P<arch_ent>\w+)\s+is"),
+    ("package",
+     r"package\s+(?P<pkg_name>\w+)\s+is"),
+    ("component",
+     r"component\s+(?P<component_name>\w+).*?end\s+component.*?;"),
+    ("signal",
+     r"signal\s+(?P<signal_name>\w+).*?;"),
+    ("constant",
+     r"constant\s+(?P<constant_name>\w+).*?;"),
+    ("record",
+     r"type\s+(?P<record_name>\w+)\s+is\s+record.*?end\s+record.*?;"),
+    ("function",
+     r"function\s+(?P<function_name>\w+)"
+     r".*?"  # gobble arguments if any.
+     r"return\s+\w+"
+     r"(?:\s+is.*?end\s+function.*?)?"  # gobble body if any.
+     r"\s*;"),
+    ("instance",
+     r"(?P<inst_label>\w+)\s*:"
+     r"\s*(?:entity\s+(?P<inst_lib>\w+)\.)?(?P<inst_ent>\w+)"
+     r"\s*(?:\(\s*(?P<inst_arch>\w+)\s*\)\s*)?"
+     r"(?:port\s+map|generic\s+map)")]
+
+_VHDL_FLAGS = re.DOTALL | re.MULTILINE | re.IGNORECASE
+
+
+def _vhdl_scanner(names):
+    """Compile a scanner for the named subset of the VHDL constructs"""
+    return re.compile(
+        r"^\s*(?:%s)" % "|".join(
+            "(?P<%s>%s)" % construct for construct in _VHDL_CONSTRUCTS
+            if construct[0] in names),
+        _VHDL_FLAGS)
+
+
+_VHDL_SCANNER = _vhdl_scanner([name for name, _ in _VHDL_CONSTRUCTS])
+
+# A construct can hide higher priority ones that start inside of it, e.g.
+# a use clause inside a function: they are searched in the matched text.
+_VHDL_HEADER_SCANNER = _vhdl_scanner(
+    ["use", "entity", "architecture", "package"])
+_VHDL_INNER_SCANNERS = {
+    "entity": _vhdl_scanner(["use"]),
+    "component": _VHDL_HEADER_SCANNER,
+    "signal": _VHDL_HEADER_SCANNER,
+    "constant": _VHDL_HEADER_SCANNER,
+    "record": _VHDL_HEADER_SCANNER,
+    "function": _VHDL_HEADER_SCANNER}
+
+_VHDL_COMMENTS = re.compile('--.*?$|".?"', re.DOTALL | re.MULTILINE)
+
+
 class VHDLParser(DepParser):
 
     """Class providing the container for VHDL parser instances"""
 
-    def __init__(self, dep_file):
-        DepParser.__init__(self, dep_file)
-        # self.preprocessor = VHDLPreprocessor()
-
     def parse(self, dep_file):
-        """Parse the provided VHDL file and add the detected relations to it"""
+        """Parse the provided VHDL file and add the detected relations to it.
+        The whole buffer is processed in a single scan"""
         from .dep_file import DepRelation
         assert not dep_file.is_parsed
 
@@ -52,207 +113,89 @@ class VHDLParser(DepParser):
                 "preprocess file %s (of length %d) in library %s",
                 vhdl_file.path, len(buf), vhdl_file.library)
             # Remove the comments and strings from the VHDL code
-            pattern = re.compile('--.*?$|".?"', re.DOTALL | re.MULTILINE)
-            return re.sub(pattern, "", buf)
-
-        buf = _preprocess(dep_file)
-        # use packages
-        use_pattern = re.compile(
-            r"^\s*use\s+(\w+)\s*\.\s*(\w+)",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+            return _VHDL_COMMENTS.sub("", buf)
 
-        def do_use(text):
-            """Function to be applied by re.sub to every match of the
-            use_pattern in the VHDL code -- group() returns positive matches
-            as indexed plain strings. It adds the found USE relations to the
-            file"""
-            lib_name = text.group(1).lower()
-            pkg_name = text.group(2).lower()
+        def do_use(match):
+            """Add the USE relation for a 'use lib.pkg' clause"""
+            lib_name = match.group("use_lib").lower()
+            pkg_name = match.group("use_pkg").lower()
             if lib_name == "work":
                 # Work is an alias for the current library
                 lib_name = dep_file.library
             logging.debug("use package %s.%s", lib_name, pkg_name)
             dep_file.add_require(
                 DepRelation(pkg_name, lib_name, DepRelation.PACKAGE))
-            return "<hdlmake use_pattern %s.%s>" % (lib_name, pkg_name)
-        buf = re.sub(use_pattern, do_use, buf)
-        
-        # new entity
-        entity_pattern = re.compile(
-            r"^\s*entity\s+(?P<name>\w+)\s+is\s+(?:port|generic|end)"
-            r".*?((?P=name)|entity)\s*;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-        def do_entity(text):
-            """Function to be applied by re.sub to every match of the
-            entity_pattern in the VHDL code -- group() returns positive matches
-            as indexed plain strings. It adds the found PROVIDE relations
-            to the file"""
-            ent_name = text.group(1)
+
+        def do_entity(match):
+            """Add the PROVIDE relation for an entity declaration"""
+            ent_name = match.group("ent_name")
             logging.debug("found entity %s.%s", dep_file.library, ent_name)
             dep_file.add_provide(
                 DepRelation(ent_name, dep_file.library, DepRelation.ENTITY))
-            return "<hdlmake entity_pattern %s.%s>" % (dep_file.library, ent_name)
-
-        buf = re.sub(entity_pattern, do_entity, buf)
-
-        # new architecture
-        architecture_split_pattern = re.compile(
-            r"^\s*architecture\s+(?P<name>\w+)\s+of\s+(\w+)\s+is",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
 
-        def do_architecture(text):
-            """Function to be applied by re.sub to every match of the
-            architecture_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It adds the found PROVIDE
-            relations to the file"""
-            arch_name = text.group(1)
-            ent_name = text.group(2)
+        def do_architecture(match):
+            """Add the PROVIDE relation for an architecture, and the USE
+            relation with the entity it belongs to"""
+            arch_name = match.group("arch_name")
+            ent_name = match.group("arch_ent")
             logging.debug("found architecture %s of entity %s.%s",
                           arch_name, dep_file.library, ent_name)
             dep_file.add_provide(
-                DepRelation(ent_name, dep_file.library, DepRelation.ARCHITECTURE))
+                DepRelation(ent_name, dep_file.library,
+                            DepRelation.ARCHITECTURE))
             dep_file.add_require(
                 DepRelation(ent_name, dep_file.library, DepRelation.ENTITY))
 
-            return "<hdlmake architecture %s.%s>" % (dep_file.library,
-                                                     text.group(2))
-        buf = re.sub(architecture_split_pattern, do_architecture, buf)
-
-        # new package
-        package_pattern = re.compile(
-            r"^\s*package\s+(\w+)\s+is",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_package(text):
-            """Function to be applied by re.sub to every match of the
-            package_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It adds the found PROVIDE
-            relations to the file"""
-            pkg_name = text.group(1)
+        def do_package(match):
+            """Add the PROVIDE relation for a package declaration"""
+            pkg_name = match.group("pkg_name")
             logging.debug("found package %s.%s", dep_file.library, pkg_name)
             dep_file.add_provide(
                 DepRelation(pkg_name, dep_file.library, DepRelation.PACKAGE))
-            return "<hdlmake package %s.%s>" % (dep_file.library, pkg_name)
-        buf = re.sub(package_pattern, do_package, buf)
-
-        # component declaration
-        component_pattern = re.compile(
-            r"^\s*component\s+(\w+).*?end\s+component.*?;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_component(text):
-            """Function to be applied by re.sub to every match of the
-            component_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It doesn't add any relation
-            to the file"""
-            logging.debug("found component declaration %s", text.group(1))
-            return "<hdlmake component %s>" % text.group(1)
-
-        buf = re.sub(component_pattern, do_component, buf)
-
-        # Signal declaration
-        signal_pattern = re.compile(
-            r"^\s*signal\s+(\w+).*?;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_signal(text):
-            """Function to be applied by re.sub to every match of the
-            signal_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It doesn't add any relation
-            to the file"""
-            logging.debug("found signal declaration %s", text.group(1))
-            return "<hdlmake signal %s>" % text.group(1)
 
-        buf = re.sub(signal_pattern, do_signal, buf)
-
-        # Constant declaration
-        constant_pattern = re.compile(
-            r"^\s*constant\s+(\w+).*?;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_constant(text):
-            """Function to be applied by re.sub to every match of the
-            constant_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It doesn't add any relation
-            to the file"""
-            logging.debug("found constant declaration %s", text.group(1))
-            return "<hdlmake constant %s>" % text.group(1)
-
-        buf = re.sub(constant_pattern, do_constant, buf)
-
-
-        # record declaration
-        record_pattern = re.compile(
-            r"^\s*type\s+(\w+)\s+is\s+record.*?end\s+record.*?;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_record(text):
-            """Function to be applied by re.sub to every match of the
-            record_pattern in the VHDL code -- group() returns positive matches
-            as indexed plain strings. It doesn't add any relation to the
-            file"""
-            logging.debug("found record declaration %s", text.group(1))
-            return "<hdlmake record %s>" % text.group(1)
-
-        buf = re.sub(record_pattern, do_record, buf)
-
-        # function declaration
-        function_pattern = re.compile(
-            r"^\s*function\s+(?P<name>\w+)"
-            r".*?" # gobble arguments if any.
-            r"return\s+\w+"
-            r"(\s+is.*?end\s+function.*?)?" # gobble body if any.
-            r"\s*;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_function(text):
-            """Function to be applied by re.sub to every match of the
-            funtion_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It doesn't add the relations
-            to the file"""
-            logging.debug("found function declaration %s", text.group(1))
-            return "<hdlmake function %s>" % text.group(1)
-
-        buf = re.sub(function_pattern, do_function, buf)
-
-        # instantiations
-        libraries = set([dep_file.library])
-        instance_pattern = re.compile(
-            r"^\s*(?P<LABEL>\w+)\s*:"
-            r"\s*(?:entity\s+(?P<LIB>\w+)\.)?(?P<ENTITY>\w+)"
-            r"\s*(?:\(\s*(?P<ARCH>\w+)\s*\)\s*)?"
-            r"(?:port\s+map.*?|generic\s+map.*?)",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
-
-        def do_instance(text):
-            """Function to be applied by re.sub to every match of the
-            instance_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It adds the found USE
-            relations to the file"""
+        def do_instance(match):
+            """Add the USE relation for an entity instantiation"""
             logging.debug("-> instantiates %s.%s(%s) as %s",
-                          text.group("LIB"), text.group("ENTITY"), text.group("ARCH"), text.group("LABEL"))
-            lib_name = text.group("LIB")
+                          match.group("inst_lib"), match.group("inst_ent"),
+                          match.group("inst_arch"), match.group("inst_label"))
+            lib_name = match.group("inst_lib")
             if not lib_name or lib_name == "work":
                 lib_name = dep_file.library
-            ent_name = text.group("ENTITY")
-            dep_file.add_require(DepRelation(ent_name, lib_name, DepRelation.ENTITY))
-            return "<hdlmake instance %s|%s|%s>" % (text.group("LABEL"), lib_name, ent_name)
-        buf = re.sub(instance_pattern, do_instance, buf)
-
-        # libraries
-        library_pattern = re.compile(
-            r"^\s*library\s*(\w+)\s*;",
-            re.DOTALL | re.MULTILINE | re.IGNORECASE)
+            ent_name = match.group("inst_ent")
+            dep_file.add_require(
+                DepRelation(ent_name, lib_name, DepRelation.ENTITY))
+
+        def do_declaration(match):
+            """Skip a declaration, it doesn't add any relation to the file"""
+            logging.debug("found %s declaration %s", match.lastgroup,
+                          match.group(match.lastgroup + "_name"))
+
+        handlers = {
+            "use": do_use,
+            "entity": do_entity,
+            "architecture": do_architecture,
+            "package": do_package,
+            "component": do_declaration,
+            "signal": do_declaration,
+            "constant": do_declaration,
+            "record": do_declaration,
+            "function": do_declaration,
+            "instance": do_instance}
+
+        def do_scan(scanner, buf, start, end):
+            """Process every construct found by scanner in buf[start:end]"""
+            for match in scanner.finditer(buf, start, end):
+                construct = match.lastgroup
+                handlers[construct](match)
+                inner_scanner = _VHDL_INNER_SCANNERS.get(construct)
+                # Only the lines after the first one may hide something.
+                if (inner_scanner is not None
+                        and buf.find("\n", match.start(construct),
+                                     match.end()) >= 0):
+                    do_scan(inner_scanner, buf, match.start(construct),
+                            match.end())
 
-        def do_library(text):
-            """Function to be applied by re.sub to every match of the
-            library_pattern in the VHDL code -- group() returns positive
-            matches as indexed plain strings. It adds the used libraries
-            to the file's 'library' property"""
-            logging.debug("use library %s", text.group(1))
-            libraries.add(text.group(1))
-            return "<hdlmake library %s>" % text.group(1)
-        buf = re.sub(library_pattern, do_library, buf)
-        # logging.debug("\n" + buf) # print modified buffer.
+        buf = _preprocess(dep_file)
+        do_scan(_VHDL_SCANNER, buf, 0, len(buf))
 
         dep_file.is_parsed = True
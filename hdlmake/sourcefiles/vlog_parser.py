@@ -30,7 +30,9 @@ from __future__ import absolute_import
 import os
 import re
 import sys
+import bisect
 import logging
+import contextlib
 
 from .new_dep_solver import DepParser
 from .dep_file import DepRelation
@@ -39,6 +41,103 @@ from collections import namedtuple
 import six
 
 
+class _TokenStream(object):
+
+    """Stream of the preprocessor tokens, kept as a stack of iterators so
+    that the tokens of an included file or of a macro expansion are spliced
+    in front of the remaining ones without copying them"""
+
+    def __init__(self, tokens):
+        self._stack = [iter(tokens)]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._stack:
+            try:
+                return next(self._stack[-1])
+            except StopIteration:
+                self._stack.pop()
+        raise StopIteration
+
+    def push(self, tokens):
+        """Insert the tokens in front of the remaining ones"""
+        self._stack.append(iter(tokens))
+
+
+class IncludeCache(object):
+
+    """Run-wide cache of the Verilog include files, holding the tokens of
+    their comment-stripped content, keyed by absolute path.  An entry is
+    only reused while the mtime and size of the file are unchanged.
+    The include paths resolved during the run are kept as well, and every
+    directory is checked once per include name.
+
+    All the preprocessors created while a cache is active, see activate(),
+    share it; otherwise each preprocessor gets its own private cache"""
+
+    current = None
+
+    def __init__(self):
+        self.entries = {}
+        self.resolved = {}
+        self.found = {}
+
+    @classmethod
+    @contextlib.contextmanager
+    def activate(cls):
+        """Share a fresh cache with the preprocessors used in this context"""
+        previous = cls.current
+        cls.current = cls()
+        try:
+            yield cls.current
+        finally:
+            cls.current = previous
+
+    def _isfile(self, directory, filename):
+        """Check if filename is a file in directory, stat once per run"""
+        key = (directory, filename)
+        found = self.found.get(key)
+        if found is None:
+            found = self.found[key] = os.path.isfile(
+                os.path.join(directory, filename))
+        return found
+
+    def resolve(self, filename, parent_dir, include_dirs):
+        """Get the absolute path of the filename include, searched first in
+        parent_dir, if any, and then in the include_dirs.  Return None if it
+        is not found.  The result is kept for the run"""
+        key = (filename, parent_dir, tuple(include_dirs))
+        try:
+            return self.resolved[key]
+        except KeyError:
+            pass
+        path = None
+        search_dirs = list(include_dirs)
+        if parent_dir is not None:
+            search_dirs.insert(0, parent_dir)
+        for searchdir in search_dirs:
+            if self._isfile(searchdir, filename):
+                path = os.path.abspath(os.path.join(searchdir, filename))
+                break
+        self.resolved[key] = path
+        return path
+
+    def get_tokens(self, path, tokenize):
+        """Get the tokens of the included file in path, calling
+        tokenize(text) on its content only if the file is not cached"""
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if (entry is not None and entry[0] == stat.st_mtime
+                and entry[1] == stat.st_size):
+            return entry[2]
+        with open(path, "r", errors='replace') as include_file:
+            tokens = tokenize(include_file.read())
+        self.entries[path] = (stat.st_mtime, stat.st_size, tokens)
+        return tokens
+
+
 class VerilogPreprocessor(object):
 
     """This class provides the Verilog Preprocessor"""
@@ -62,20 +161,18 @@ class VerilogPreprocessor(object):
         self.vpp_macros = []
         self.included_files = set()
         self.macro_depth = 0
+        self.include_cache = None
 
     def _search_include(self, filename, parent_dir=None):
         """Look for the 'filename' Verilog include file in the
         provided 'parent_dir'. If the directory is not provided, the method
         will search for the Verilog include in every defined Verilog
-        preprocessor search directory"""
-        if parent_dir is not None:
-            possible_file = os.path.join(parent_dir, filename)
-            if os.path.isfile(possible_file):
-                return os.path.abspath(possible_file)
-        for searchdir in self.vlog_file.include_dirs:
-            probable_file = os.path.join(searchdir, filename)
-            if os.path.isfile(probable_file):
-                return os.path.abspath(probable_file)
+        preprocessor search directory.  The lookups are kept in the
+        include cache"""
+        path = self.include_cache.resolve(filename, parent_dir,
+                                          self.vlog_file.include_dirs)
+        if path is not None:
+            return path
         raise Exception("Can't find {} for {} in any of the include "
                         "directories: {}".format(filename, self.vlog_file.path,
                         ', '.join(self.vlog_file.include_dirs)))
@@ -108,32 +205,29 @@ class VerilogPreprocessor(object):
             def _munge_list(flist):
                 '''Take the split list & normalize into a list of string literals & seperator matches'''
                 assert flist
-                is_match = False # if nothing was present, split inserts an empty element
+                # split alternates a string literal (maybe empty) and the
+                # 9 groups of a separator match
                 rlist = []
-                while flist:
-                    if is_match:
-                        assert len(flist) >= 9, "_munge_list: insufficient arguments for match object"
-                        rlist.append(vpp_match(flist[0],flist[1],None if not flist[2] else flist[2].strip(),
-                                               flist[3],flist[4],'' if not flist[5] else flist[5].replace('\\\n',''),flist[6],flist[7]))
-                        flist = flist[9:]
-                    else:
-                        rlist.append(flist.pop(0))
-                    is_match = not is_match
+                for index in range(0, len(flist), 10):
+                    rlist.append(flist[index])
+                    groups = flist[index + 1:index + 10]
+                    if not groups:
+                        break
+                    assert len(groups) == 9, "_munge_list: insufficient arguments for match object"
+                    rlist.append(vpp_match(groups[0],groups[1],None if not groups[2] else groups[2].strip(),
+                                           groups[3],groups[4],'' if not groups[5] else groups[5].replace('\\\n',''),groups[6],groups[7]))
                 return rlist
 
             def _tok_string(text):
                 toks = re.split(r'((?:`(ifn?def|elsif|else|endif|define|include)((?<=ifdef\b)\s+(?:\w+)|(?<=ifndef\b)\s+(?:\w+)|(?<=elsif\b)\s+(?:\w+)|(?:(?<=define\b)\s+(\w+)(?:\(([\w\s,]*)\))?[ \t]*((?:\\\n|[^\n\r])*)$)|(?<=include\b)\s+"(.+?)")?)|(?:`(\w+)(?:\(([\w\s,]*)\))?))', text, flags=re.MULTILINE)
                 return _munge_list(toks)
 
-            parts = _tok_string(text)
-
             # PP tokens
             vpp_macros = {}
 
-            def _proc_macros_layer(parts, gmacros):
+            def _proc_macros_layer(front, parts, gmacros):
                 '''Process a level of macros'''
-                lbuf    = ""
-                front   = parts.pop(0)
+                lbuf    = []
                 enabled = True
                 handled = False # we've handled an if condition
                 lmacros = dict(gmacros)
@@ -141,7 +235,7 @@ class VerilogPreprocessor(object):
                 # we should only arrive here because either the start of a string was seen
                 # or an ifdef was detected
                 if isinstance(front, str):
-                    lbuf = front
+                    lbuf.append(front)
                 elif front.pptype in ('ifdef','ifndef'):
                     enabled = front.ppident in lmacros
                     if front.pptype == 'ifndef':
@@ -150,18 +244,16 @@ class VerilogPreprocessor(object):
                 else:
                     raise Exception("verilog preprocessor: unexpected token '%s'" % front[1])
 
-                while parts:
+                for front in parts:
                     # handle further ifdefs recusively
-                    front = parts.pop(0)
                     if isinstance(front, str):
                         if enabled:
-                            lbuf += front
+                            lbuf.append(front)
                     elif front.pptype in ('ifdef', 'ifndef'):
-                        # ifdef requires a new level, reinsert element & parse next level
-                        parts.insert(0, front)
-                        ctext, parts, cmacros = _proc_macros_layer(parts, lmacros)
+                        # ifdef requires a new level, parse it from the same stream
+                        ctext, cmacros = _proc_macros_layer(front, parts, lmacros)
                         if enabled:
-                            lbuf    += ctext
+                            lbuf.append(ctext)
                             lmacros  = cmacros
                     elif front.pptype == 'elsif':
                         if not handled:
@@ -176,13 +268,13 @@ class VerilogPreprocessor(object):
                         else:
                             enabled = False
                     elif front.pptype == 'endif':
-                        return lbuf, parts, lmacros
+                        return "".join(lbuf), lmacros
                     elif front.pptype == 'define':
                         if enabled:
                             if front.macroident in self.vpp_keywords:
                                 raise Exception("Attempt to `define a reserved preprocessor keyword")
                             lmacros[front.macroident] = vpp_macrodefn(front.ppargs, front.ppdefn)
-                            lbuf += front.mtext.replace('\\\n','')
+                            lbuf.append(front.mtext.replace('\\\n',''))
                     elif front.pptype == "include":
                         if enabled:
                             # maybe add a check for recusion here?
@@ -192,10 +284,10 @@ class VerilogPreprocessor(object):
                                           file_name, library, included_file_path)
                             # add include file to the dependancies
                             self.included_files.add(included_file_path)
-                            # tokenize the file & prepend to the current stack
-                            decomment = _remove_comment(open(included_file_path, "r", errors='replace').read())
-                            tokens = _tok_string(decomment)
-                            parts = tokens + parts
+                            # tokenize the file & splice it in front of the stream
+                            parts.push(self.include_cache.get_tokens(
+                                included_file_path,
+                                lambda text: _tok_string(_remove_comment(text))))
                     elif front.pptype == 'pop_macro':
                         self.macro_depth -= 1
                         assert self.macro_depth >= 0
@@ -206,18 +298,19 @@ class VerilogPreprocessor(object):
                             if front.substid in lmacros:
                                 tokens = _tok_string(lmacros[front.substid].expansion)
                                 tokens.append(vpp_match(None, 'pop_macro', front.substid, None, None, None, None, None))
-                                parts = tokens + parts
+                                parts.push(tokens)
                                 self.macro_depth += 1
                                 if self.macro_depth > 30:
                                     raise Exception("Recursion level exceeded. Nested `includes?")
                             else:
-                                lbuf += front.mtext
+                                lbuf.append(front.mtext)
                     else:
                         raise Exception("verilog preprocessor: unexpected token '%s' from %s" % (front[1], str(front)))
 
-                return lbuf, parts, lmacros
+                return "".join(lbuf), lmacros
 
-            return re.sub(r'^\s*\n','', _proc_macros_layer(parts, vpp_macros)[0], flags=re.MULTILINE)
+            parts = _TokenStream(_tok_string(text))
+            return re.sub(r'^\s*\n','', _proc_macros_layer(next(parts), parts, vpp_macros)[0], flags=re.MULTILINE)
 
         # init dependencies
         logging.debug("preprocess file %s (of length %d) in library %s",
@@ -232,12 +325,224 @@ class VerilogPreprocessor(object):
         # assert isinstance(vlog_file, VerilogFile)
         # assert isinstance(vlog_file, DepFile)
         self.vlog_file = vlog_file
+        if IncludeCache.current is not None:
+            self.include_cache = IncludeCache.current
+        elif self.include_cache is None:
+            self.include_cache = IncludeCache()
         buf = open(vlog_file.path, "r", errors='replace').read()
         return self._preprocess_file(file_content=buf,
                                      file_name=vlog_file.path,
                                      library=vlog_file.library)
 
 
+# Tokens of the preprocessed Verilog code: string literals (an unterminated
+# one stops at the end of the line), identifiers and numbers, the scope
+# operator and any other single character.
+_VLOG_TOKEN = re.compile(r'"(?:\\.|[^\\"\n])*"?|[\w$]+|::|\S')
+
+_VLOG_BRACKETS = {")": "(", "]": "[", "}": "{"}
+
+
+class _ModuleScanner(object):
+
+    """Linear scanner of the preprocessed Verilog code, looking for the
+    declared modules, interfaces and packages, and for the instantiations
+    inside of the modules.
+
+    The code is split into tokens and the matching brackets are paired in
+    a first pass, so that a construct is recognized by jumping over its
+    bracketed parts: every token is visited a bounded number of times,
+    whatever the input"""
+
+    # Keywords after which a new statement starts
+    STMT_KEYWORDS = frozenset([
+        "begin", "end", "fork", "join", "join_any", "join_none",
+        "generate", "endgenerate", "endcase", "else"])
+    # Keywords followed by a condition, after which a new statement starts
+    COND_KEYWORDS = frozenset([
+        "if", "for", "foreach", "while", "repeat", "case", "casex", "casez"])
+    # Keywords closing the routines, whose bodies are skipped
+    ROUTINE_ENDS = {"function": "endfunction", "task": "endtask"}
+    LIFETIMES = frozenset(["static", "automatic"])
+
+    def __init__(self, buf, reserved_words):
+        self.tokens = _VLOG_TOKEN.findall(buf)
+        self.reserved_words = reserved_words
+        self.pairs = self._pair_brackets(self.tokens)
+        # Positions of the closing keywords, to find the next one quickly
+        self.closers = {}
+        for index, token in enumerate(self.tokens):
+            if token in ("endmodule", "endinterface", "endpackage",
+                         "endfunction", "endtask", ";"):
+                self.closers.setdefault(token, []).append(index)
+
+    @staticmethod
+    def _pair_brackets(tokens):
+        """Get for every opening bracket the index of the matching closing
+        one, or None.  Mismatched closing brackets are ignored"""
+        pairs = [None] * len(tokens)
+        stack = []
+        for index, token in enumerate(tokens):
+            if token in ("(", "[", "{"):
+                stack.append(index)
+            elif token in _VLOG_BRACKETS:
+                if stack and tokens[stack[-1]] == _VLOG_BRACKETS[token]:
+                    pairs[stack.pop()] = index
+        return pairs
+
+    def _token(self, index):
+        """Get the token at index, or an empty string past the end"""
+        if index < len(self.tokens):
+            return self.tokens[index]
+        return ""
+
+    def _is_name(self, index):
+        """Check if the token at index is an identifier"""
+        token = self._token(index)
+        return token[:1].isalpha() or token[:1] == "_"
+
+    def _skip_brackets(self, index):
+        """Get the index after the bracketed part opened at index, or None
+        if the bracket is not closed"""
+        closing = self.pairs[index] if index < len(self.tokens) else None
+        return None if closing is None else closing + 1
+
+    def _next_closer(self, keywords, index):
+        """Get the index of the first of the keywords after index, or None"""
+        found = None
+        for keyword in keywords:
+            indexes = self.closers.get(keyword, [])
+            position = bisect.bisect_left(indexes, index)
+            if position < len(indexes):
+                if found is None or indexes[position] < found:
+                    found = indexes[position]
+        return found
+
+    def scan(self):
+        """Generate the found constructs as tuples: ("package", name),
+        ("module", name) and ("instance", module name, instance name)"""
+        index = 0
+        while index < len(self.tokens):
+            token = self.tokens[index]
+            index += 1
+            if token == "package":
+                if self._token(index) in self.LIFETIMES:
+                    index += 1
+                end = self._next_closer(["endpackage"], index)
+                if self._is_name(index) and end is not None:
+                    yield ("package", self.tokens[index])
+                    index = end + 1
+            elif token in ("module", "interface"):
+                body = self._module_header(index)
+                end = None
+                if body is not None:
+                    end = self._next_closer(["endmodule", "endinterface"],
+                                            body)
+                if end is not None:
+                    yield ("module", self._module_name(index))
+                    for instance in self._module_body(body, end):
+                        yield instance
+                    index = end + 1
+
+    def _module_name(self, index):
+        """Get the name of the module declared at index"""
+        if self._token(index) in self.LIFETIMES:
+            index += 1
+        return self.tokens[index]
+
+    def _module_header(self, index):
+        """Parse the module header starting at index (after the keyword):
+        [lifetime] name [imports] [#(parameters)] [(ports)] ;
+        Return the index of the body, or None if this is not a header"""
+        if self._token(index) in self.LIFETIMES:
+            index += 1
+        if not self._is_name(index):
+            return None
+        index += 1
+        while self._token(index) == "import":
+            # Package import declarations in the header
+            index = self._next_closer([";"], index)
+            if index is None:
+                return None
+            index += 1
+        if self._token(index) == "#":
+            if self._token(index + 1) != "(":
+                return None
+            index = self._skip_brackets(index + 1)
+            if index is None:
+                return None
+        if self._token(index) == "(":
+            index = self._skip_brackets(index)
+            if index is None:
+                return None
+        if self._token(index) != ";":
+            return None
+        return index + 1
+
+    def _instance(self, index, end):
+        """Try to parse an instantiation starting at index:
+        module [#(parameters)] name [[range]] (ports) ; or ,
+        Return the index after it and the instance names, or None"""
+        mod_index = index
+        index += 1
+        if self._token(index) == "#":
+            if self._token(index + 1) != "(":
+                return None
+            index = self._skip_brackets(index + 1)
+            if index is None:
+                return None
+        if not self._is_name(index):
+            return None
+        inst_index = index
+        index += 1
+        while self._token(index) == "[":
+            index = self._skip_brackets(index)
+            if index is None:
+                return None
+        if self._token(index) != "(":
+            return None
+        index = self._skip_brackets(index)
+        if index is None or index > end:
+            return None
+        if index != end and self._token(index) not in (";", ","):
+            return None
+        return index, ("instance", self.tokens[mod_index],
+                       self.tokens[inst_index])
+
+    def _module_body(self, index, end):
+        """Generate the instantiations in the module body tokens[index:end]"""
+        stmt_start = True
+        while index < end:
+            token = self.tokens[index]
+            if (stmt_start and self._is_name(index)
+                    and token not in self.reserved_words):
+                instance = self._instance(index, end)
+                if instance is not None:
+                    index, found = instance
+                    yield found
+                    continue
+            index += 1
+            stmt_start = False
+            if token == ";" or token in self.STMT_KEYWORDS:
+                stmt_start = True
+                if self._token(index) == ":" and self._is_name(index + 1):
+                    # Block label
+                    index += 2
+            elif token in self.COND_KEYWORDS or token == "@":
+                if self._token(index) == "(":
+                    index = self._skip_brackets(index) or index + 1
+                elif token == "@":
+                    # @* or @event
+                    index += 1
+                stmt_start = True
+            elif token in self.ROUTINE_ENDS:
+                routine_end = self._next_closer([self.ROUTINE_ENDS[token]],
+                                                index)
+                if routine_end is not None and routine_end < end:
+                    index = routine_end + 1
+                    stmt_start = True
+
+
 class VerilogParser(DepParser):
 
     """Class providing the Verilog Parser functionality"""
@@ -482,10 +787,7 @@ class VerilogParser(DepParser):
                       "wor",
                       "xnor",
                       "xor"]
-
-    def __init__(self, dep_file):
-        DepParser.__init__(self, dep_file)
-        self.preprocessor = VerilogPreprocessor()
+    reserved_set = frozenset(reserved_words)
 
     def parse(self, dep_file):
         """Parse the provided Verilog file and add to its properties
@@ -496,8 +798,9 @@ class VerilogParser(DepParser):
         # str(type(dep_file)))
 
         # Preprocess the file and add included files as dependencies
-        buf = self.preprocessor.preprocess(dep_file)
-        dep_file.included_files = self.preprocessor.included_files
+        preprocessor = VerilogPreprocessor()
+        buf = preprocessor.preprocess(dep_file)
+        dep_file.included_files = preprocessor.included_files
         logging.debug("%s has %d includes.", str(dep_file), len(dep_file.included_files))
 
         # look for packages used inside in file
@@ -523,61 +826,26 @@ class VerilogParser(DepParser):
             dep_file.add_require(
                 DepRelation(pkg_name, dep_file.library, DepRelation.PACKAGE))
         import_pattern.subn(do_imports, buf)
-        # packages
-        m_inside_package = re.compile(
-            r"package\s+(\w+)\s*(?:\(.*?\))?\s*(.+?)endpackage",
-            re.DOTALL | re.MULTILINE)
-
-        def do_package(text):
-            """Function to be applied by re.subn to every match of the
-            m_inside_pattern in the Verilog code -- group() returns positive
-            matches as indexed plain strings. It adds the found PROVIDE
-            relations to the file"""
-            pkg_name = text.group(1)
-            logging.debug("found pacakge %s.%s", dep_file.library, pkg_name)
-            dep_file.add_provide(
-                DepRelation(pkg_name, dep_file.library, DepRelation.PACKAGE))
-        m_inside_package.subn(do_package, buf)
-
-        # modules and instantiations
-        m_inside_module = re.compile(
-            r"(?:module|interface)\s+(\w+)\s*(?:#\s*\(.*?\)\s*)?(?:\(.*?\))?\s*;\s*(.+?)"
-            r"(?:endmodule|endinterface)",
-            re.DOTALL | re.MULTILINE)
-        m_instantiation = re.compile(
-            r"\s*\b(\w+)\s+(?:#\s*\(.*?\)\s*)?(\w+)\s*(?:\[.*?\]\s*)?\(.*?\)$",
-            re.DOTALL | re.MULTILINE)
-
-        m_stmt = re.compile(r'''(?:\s*(?:(?:\b(?:function|task)\b.*?\bend(?:function|task)\b)|(?:\bbegin(?:\s*:\s*\w+)?)|(?:\bend\b(?:\s*:\s*\w+)?)|(?:end(?:generate|case)\b)|(?:\b(?:case|if|for)\s*\(.*?\))|(?:\b(?:else|generate)\b)|\b(?:assign|localparam|wire|logic|reg)\b[^;]*?(?:=.*?)?;|\balways(?:_ff|_latch|_comb)?\b\s*(?:@\s*(?:\*|(?:\(.*?\))))?|;)\s*)+''',
-                            re.MULTILINE | re.DOTALL)
-
-        def do_module(text):
-            """Function to be applied by re.sub to every match of the
-            m_inside_module in the Verilog code -- group() returns
-            positive  matches as indexed plain strings. It adds the found
-            PROVIDE relations to the file"""
-            module_name = text.group(1)
-            logging.debug("found module %s.%s", dep_file.library, module_name)
-            dep_file.add_provide(
-                DepRelation(module_name, dep_file.library, DepRelation.MODULE))
-
-            def do_inst(text):
-                """Function to be applied by re.sub to every match of the
-                m_instantiation in the Verilog code -- group() returns positive
-                matches as indexed plain strings. It adds the found USE
-                relations to the file"""
-                mod_name = text.group(1)
-                if mod_name in self.reserved_words:
-                    # A gate (and, or, ...)
-                    return
+        # packages, modules and instantiations
+        scanner = _ModuleScanner(buf, self.reserved_set)
+        for found in scanner.scan():
+            if found[0] == "package":
+                logging.debug("found pacakge %s.%s", dep_file.library,
+                              found[1])
+                dep_file.add_provide(
+                    DepRelation(found[1], dep_file.library,
+                                DepRelation.PACKAGE))
+            elif found[0] == "module":
+                logging.debug("found module %s.%s", dep_file.library,
+                              found[1])
+                dep_file.add_provide(
+                    DepRelation(found[1], dep_file.library,
+                                DepRelation.MODULE))
+            else:
                 logging.debug("-> instantiates %s.%s as %s",
-                              dep_file.library, mod_name, text.group(2))
+                              dep_file.library, found[1], found[2])
                 dep_file.add_require(
-                    DepRelation(mod_name, dep_file.library, DepRelation.MODULE))
-            for stmt in [x for x in m_stmt.split(text.group(2)) if x and x[-1] == ")"]:
-                match = m_instantiation.match(stmt)
-                if match:
-                    do_inst(match)
-        m_inside_module.subn(do_module, buf)
+                    DepRelation(found[1], dep_file.library,
+                                DepRelation.MODULE))
 
         dep_file.is_parsed = True
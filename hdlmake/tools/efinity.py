@@ -91,18 +91,17 @@ class ToolEfinity(MakefileSyn):
         fileset_dict.update(self.SUPPORTED_FILES)
         for filetype in fileset_dict:
             file_list = []
-            for file_aux in self.fileset:
-                if isinstance(file_aux, filetype):
-                    if filetype == VHDLFile: 
-                        vhdl_list.append(shell.tclpath(file_aux.rel_path()))
-                    if filetype == SDCFile: 
-                        sdc_list.append(shell.tclpath(file_aux.rel_path()))
-                    if filetype == VerilogFile: 
-                        vlog_list.append(shell.tclpath(file_aux.rel_path()))
-                        if isinstance(file_aux, SVFile):
-                        # Discard SVerilog files for verilog type.
-                            continue
-                    file_list.append(shell.tclpath(file_aux.rel_path()))
+            for file_aux in self.fileset.filter(filetype):
+                if filetype == VHDLFile: 
+                    vhdl_list.append(shell.tclpath(file_aux.rel_path()))
+                if filetype == SDCFile: 
+                    sdc_list.append(shell.tclpath(file_aux.rel_path()))
+                if filetype == VerilogFile: 
+                    vlog_list.append(shell.tclpath(file_aux.rel_path()))
+                    if isinstance(file_aux, SVFile):
+                    # Discard SVerilog files for verilog type.
+                        continue
+                file_list.append(shell.tclpath(file_aux.rel_path()))
             if not file_list == []:
                 ret.append( 'SOURCES_{0} += ' '{1}\n'.format(filetype.__name__, ' \n' 'SOURCES_{0} += '.format(filetype.__name__).join(file_list)))
                 if not fileset_dict[filetype] is None:
@@ -165,10 +165,9 @@ $(TCL_CLOSE)'''
         fileset_dict.update(self.CORE_FILES)
         for filetype in fileset_dict:
             ip_list = []
-            for file_aux in self.fileset:
-                if isinstance(file_aux, filetype):
-                    ip_core = os.path.splitext(os.path.basename(shell.tclpath(file_aux.rel_path())))[0]
-                    ip_list.append(ip_core)
+            for file_aux in self.fileset.filter(filetype):
+                ip_core = os.path.splitext(os.path.basename(shell.tclpath(file_aux.rel_path())))[0]
+                ip_list.append(ip_core)
             if not ip_list == []:
                 ret.append( 'IP_CORES += ' '{1}\n'.format(filetype.__name__, ' \n' 'IP_CORES += '.format(filetype.__name__).join(ip_list)))
                 if not fileset_dict[filetype] is None:
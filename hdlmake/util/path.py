@@ -25,6 +25,8 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import os
+import re
+import fnmatch
 
 
 def url_parse(url):
@@ -129,3 +131,144 @@ def flatten_list(sth):
     else:
         sth = []
     return sth
+
+
+_MAGIC_CHECK = re.compile(r"[*?[]")
+
+
+def has_magic(path):
+    """Check if the given path is a glob pattern"""
+    return _MAGIC_CHECK.search(path) is not None
+
+
+class PathScanner(object):
+
+    """Class providing the cached listing of the directories, built with a
+    single os.scandir pass per directory.  The type of every entry is then
+    known without any further stat, and a single instance is shared by all
+    of the modules, so that the directories are only listed once"""
+
+    def __init__(self):
+        # Both are keyed by the absolute path of the directory
+        self.listings = {}
+        # The directories whose content was requested, not only checked
+        self.walked = set()
+
+    def _listing(self, dir_path):
+        """Get the {name: (is_dir, is_link)} entries of the directory,
+        None if it cannot be listed"""
+        dir_path = os.path.abspath(dir_path)
+        if dir_path in self.listings:
+            return self.listings[dir_path]
+        listing = {}
+        try:
+            for entry in os.scandir(dir_path):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                listing[entry.name] = (is_dir, entry.is_symlink())
+        except OSError:
+            listing = None
+        self.listings[dir_path] = listing
+        return listing
+
+    def kind(self, path):
+        """Get the type of the given path: 'dir', 'file' or None if it
+        doesn't exist.  It is found in the listing of the parent dir"""
+        dir_path, name = os.path.split(os.path.normpath(path))
+        listing = None
+        if name not in ("", os.curdir, os.pardir):
+            listing = self._listing(dir_path or os.curdir)
+        if listing is None or name not in listing:
+            # Not listed, e.g. on a case insensitive filesystem: stat it
+            if os.path.isdir(path):
+                return "dir"
+            return "file" if os.path.exists(path) else None
+        is_dir, is_link = listing[name]
+        if is_dir:
+            return "dir"
+        if is_link and not os.path.exists(path):
+            return None
+        return "file"
+
+    def isdir(self, path):
+        """Check if the given path is an existing directory"""
+        return self.kind(path) == "dir"
+
+    def list_files(self, dir_path):
+        """Get the paths of the entries of the directory that are not
+        directories themselves"""
+        self.walked.add(os.path.abspath(dir_path))
+        listing = self._listing(dir_path) or {}
+        return [os.path.join(dir_path, name)
+                for name, (is_dir, _) in listing.items() if not is_dir]
+
+    def _literal(self, base, parts):
+        """Get the path made of the parts under base if it is an existing
+        file, else None.  Only the listings of the existing directories
+        are read"""
+        path = base
+        for index, part in enumerate(parts):
+            listing = self._listing(path or os.curdir)
+            if listing is None or part not in listing:
+                return None
+            is_dir = listing[part][0]
+            path = os.path.join(path, part)
+            if is_dir != (index < len(parts) - 1):
+                return None
+        return path
+
+    def glob(self, pattern):
+        """Get the sorted paths of the files matching the glob pattern, in
+        which '**' matches any number of nested directories.  The hidden
+        entries only match patterns that start with a dot, and the
+        symbolic links to directories are not followed by '**'.  A pattern
+        that is the path of an existing file, e.g. a name with brackets,
+        only matches that file"""
+        parts = [part for part in pattern.replace(os.sep, "/").split("/")
+                 if part]
+        if parts[-1] == "**":
+            parts.append("*")
+        # The directories before the first wildcard are not walked
+        base = pattern[:len(pattern) - len(pattern.lstrip("/" + os.sep))]
+        while parts and not has_magic(parts[0]):
+            base = os.path.join(base, parts.pop(0))
+        if not parts:
+            return [base] if self.kind(base) == "file" else []
+        literal = self._literal(base, parts)
+        if literal is not None:
+            return [literal]
+        matches = set()
+
+        def _walk(dir_path, parts):
+            """Add the files under dir_path that match the parts"""
+            dir_path = dir_path or os.curdir
+            self.walked.add(os.path.abspath(dir_path))
+            part, rest = parts[0], parts[1:]
+            if not has_magic(part):
+                path = os.path.join(dir_path, part)
+                kind = self.kind(path)
+                if rest and kind == "dir":
+                    _walk(path, rest)
+                elif not rest and kind == "file":
+                    matches.add(path)
+                return
+            listing = self._listing(dir_path) or {}
+            for name, (is_dir, is_link) in listing.items():
+                if name.startswith(".") and not part.startswith("."):
+                    continue
+                path = os.path.join(dir_path, name)
+                if part == "**":
+                    if is_dir and not is_link:
+                        _walk(path, parts)
+                elif fnmatch.fnmatch(name, part):
+                    if rest and is_dir:
+                        _walk(path, rest)
+                    elif not rest and not is_dir:
+                        matches.add(path)
+            if part == "**":
+                _walk(dir_path, rest)
+
+        _walk(base, parts)
+        return sorted(matches)
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 CERN
+#
+# This file is part of Hdlmake.
+#
+# Hdlmake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Hdlmake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Hdlmake.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Module providing the runner of the external commands, such as the
+ones of the code fetchers"""
+
+from __future__ import absolute_import
+import asyncio
+import logging
+import threading
+from asyncio.subprocess import PIPE, DEVNULL
+
+
+class CommandError(Exception):
+
+    """Error raised when a command cannot be started, fails or times out"""
+
+    def __init__(self, command, returncode, output="", errors="",
+                 timeout=None):
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+        self.errors = errors
+        self.timeout = timeout
+        if timeout is not None:
+            message = "Command timed out after {}s".format(timeout)
+        elif returncode is None:
+            message = "Command cannot be started"
+        else:
+            message = "Command failed with exit code {}".format(returncode)
+        message += ": " + command_str(command)
+        details = (errors or output).strip()
+        if details:
+            message += "\n" + "\n".join(details.splitlines()[-10:])
+        super(CommandError, self).__init__(message)
+
+
+class CommandResult(object):
+
+    """The exit code and the captured output of a finished command"""
+
+    def __init__(self, returncode, output, errors):
+        self.returncode = returncode
+        self.output = output
+        self.errors = errors
+
+    def first_line(self):
+        """Get the first line of the output, None if there is no output"""
+        lines = self.output.splitlines()
+        return lines[0].strip() if lines else None
+
+
+def command_str(command):
+    """Get a printable version of the command"""
+    if isinstance(command, (list, tuple)):
+        return " ".join(command)
+    return command
+
+
+class CommandRunner(object):
+
+    """Class running the external commands on a single asyncio event loop,
+    living in a background thread, so that the commands can be started
+    from any thread.  The commands are executed from an argument vector,
+    without any shell, unless a shell command line is explicitly given.
+
+    Their output is streamed to the log, line by line, and captured.  At
+    most 'jobs' commands run at once, and a command running for longer than
+    its timeout is killed.  A failure raises a CommandError"""
+
+    def __init__(self, jobs=1, timeout=None):
+        self.jobs = jobs
+        self.timeout = timeout
+        self._loop = None
+        # Both are only used from the event loop
+        self._semaphore = None
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def configure(self, jobs=None, timeout=None):
+        """Set the limit of concurrent commands, and the default timeout in
+        seconds (None for no timeout).  The limit cannot be changed while
+        commands are running"""
+        if jobs is not None:
+            if jobs < 1:
+                raise ValueError("The number of jobs must be at least 1")
+            with self._lock:
+                loop = self._loop
+                if loop is None:
+                    # No command has been started yet
+                    self.jobs = jobs
+            if loop is not None:
+                asyncio.run_coroutine_threadsafe(
+                    self._set_jobs(jobs), loop).result()
+        self.timeout = timeout
+
+    async def _set_jobs(self, jobs):
+        """Change the limit of concurrent commands in the event loop"""
+        if self._running:
+            raise RuntimeError("Cannot change the number of jobs while "
+                               "commands are running")
+        self.jobs = jobs
+        self._semaphore = None
+
+    def _get_loop(self):
+        """Get the event loop, started on the first use"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever,
+                                          name="hdlmake-runner")
+                thread.daemon = True
+                thread.start()
+            return self._loop
+
+    @staticmethod
+    async def _read_stream(stream, lines, echo):
+        """Capture the lines of the stream as they arrive"""
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            lines.append(line)
+            echo(line)
+
+    async def _execute(self, command, cwd, timeout, echo, stdin):
+        """Run the command in the event loop"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.jobs)
+        self._running += 1
+        try:
+            return await self._execute_locked(command, cwd, timeout, echo,
+                                              stdin)
+        finally:
+            self._running -= 1
+
+    async def _execute_locked(self, command, cwd, timeout, echo, stdin):
+        """Run the command once a job is available"""
+        async with self._semaphore:
+            logging.debug("run: %s", command_str(command))
+            try:
+                if isinstance(command, (list, tuple)):
+                    process = await asyncio.create_subprocess_exec(
+                        *command, stdin=stdin, stdout=PIPE, stderr=PIPE,
+                        cwd=cwd)
+                else:
+                    process = await asyncio.create_subprocess_shell(
+                        command, stdin=stdin, stdout=PIPE, stderr=PIPE,
+                        cwd=cwd)
+            except OSError as error:
+                raise CommandError(command, None, errors=str(error))
+            output = []
+            errors = []
+
+            async def _communicate():
+                """Read both streams until the end of the process"""
+                await asyncio.gather(
+                    self._read_stream(process.stdout, output, echo),
+                    self._read_stream(process.stderr, errors, echo))
+                return await process.wait()
+
+            try:
+                returncode = await asyncio.wait_for(_communicate(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise CommandError(command, process.returncode,
+                                   "\n".join(output), "\n".join(errors),
+                                   timeout=timeout)
+        return CommandResult(returncode, "\n".join(output),
+                             "\n".join(errors))
+
+    def _submit(self, command, cwd, timeout, echo, stdin=DEVNULL):
+        """Start the command in the event loop, get its future"""
+        if timeout is None:
+            timeout = self.timeout
+        if echo is None:
+            echo = logging.debug
+        return asyncio.run_coroutine_threadsafe(
+            self._execute(command, cwd, timeout, echo, stdin),
+            self._get_loop())
+
+    @staticmethod
+    def _check(command, result, check):
+        """Raise a CommandError for the failed command if check"""
+        if check and result.returncode != 0:
+            raise CommandError(command, result.returncode,
+                               result.output, result.errors)
+        return result
+
+    def run(self, command, cwd=None, timeout=None, check=True, echo=None,
+            stdin=DEVNULL):
+        """Run the command, either an argument vector or a shell command
+        line, from the cwd directory and wait for its CommandResult.  The
+        output lines are passed to echo, logged as debug by default.  If
+        check, a non zero exit code raises a CommandError.  The command
+        reads nothing, unless stdin is None: it then inherits the input of
+        hdlmake, e.g. to prompt the user"""
+        result = self._submit(command, cwd, timeout, echo, stdin).result()
+        return self._check(command, result, check)
+
+    def run_all(self, commands, cwd=None, timeout=None, check=True,
+                echo=None):
+        """Run the given commands concurrently, within the limit of jobs,
+        and get their results in the same order.  If check, the first
+        failed command raises a CommandError once all of them are done"""
+        futures = [self._submit(command, cwd, timeout, echo)
+                   for command in commands]
+        results = []
+        error = None
+        for command, future in zip(commands, futures):
+            try:
+                results.append(self._check(command, future.result(), check))
+            except CommandError as command_error:
+                error = error or command_error
+                results.append(None)
+        if error is not None:
+            raise error
+        return results
+
+    def succeeds(self, command, cwd=None, timeout=None):
+        """Run the command, and check if its exit code is 0"""
+        return self.run(command, cwd=cwd, timeout=timeout,
+                        check=False).returncode == 0
+
+
+# The runner shared by the whole hdlmake process
+runner = CommandRunner()
+
+
+def run(command, cwd=None, timeout=None, check=True, echo=None,
+        stdin=DEVNULL):
+    """Run the command with the shared runner, see CommandRunner.run"""
+    return runner.run(command, cwd=cwd, timeout=timeout, check=check,
+                      echo=echo, stdin=stdin)
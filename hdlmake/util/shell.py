@@ -28,7 +28,6 @@ import os
 import sys
 import platform
 import logging
-from subprocess import PIPE, Popen, CalledProcessError
 
 
 commands_os = 'auto'
@@ -43,26 +42,10 @@ def set_commands_os(name):
 
 
 def run(command):
-    """Execute a command in the shell and print the output lines as a list"""
-    try:
-        logging.debug("run: {}".format(command))
-        command_out = Popen(command,
-            stdout=PIPE,
-            stdin=PIPE,
-            stderr=PIPE,
-            close_fds=not check_windows_tools(), # FIXME: comment
-            shell=True)
-        lines = command_out.stdout.readlines()
-        if command_out.wait() != 0:
-            logging.error("Shell command failed: %s", command)
-            quit(1)
-        if len(lines) == 0:
-            return None
-        return lines[0].strip().decode('utf-8')
-    except CalledProcessError as process_error:
-        logging.error("Cannot execute the shell command: %s",
-            process_error.output)
-        quit(1)
+    """Execute a command line in the shell and return the first line of its
+    output, None if there is none.  A CommandError is raised on failure"""
+    from .runner import run as run_command
+    return run_command(command).first_line()
 
 
 def tclpath(path):
@@ -0,0 +1,12 @@
+action = "simulation"
+
+sim_tool="modelsim"
+
+top_module = "gate"
+fetchto = "ipcores"
+
+files = [ "../files/gate.vhdl" ]
+modules = { "git" : [ "git@test.org:tester/module3.git",
+                      "git@test.org:tester/unknown.git",
+                      "git@test.org:tester/module2.git",
+                      "git@test.org:tester/unknown2.git" ] }
@@ -3,6 +3,8 @@
 
 import hdlmake.main
 from hdlmake.manifest_parser.configparser import ConfigParser
+from hdlmake.sourcefiles.dep_file import DepFile
+from hdlmake.sourcefiles import new_dep_solver
 import os
 import os.path
 import pytest
@@ -90,6 +92,12 @@ def test_fetch():
 def test_clean():
     run(['clean'], path="001ise")
 
+def test_clean_cache():
+    run(['list-files'], path="001ise")
+    assert os.path.isdir("001ise/.hdlmake-cache")
+    run(['clean'], path="001ise")
+    assert not os.path.exists("001ise/.hdlmake-cache")
+
 def test_list_mods_none():
     run(['list-mods'], path="001ise")
 
@@ -99,6 +107,10 @@ def test_list_files():
 def test_circular_dep_096():
     run(['list-files'], path="096circular_dep")
 
+def test_circular_dep_strict_096():
+    with pytest.raises(SystemExit) as _:
+        run(['--strict-cycles', 'list-files'], path="096circular_dep")
+
 def test_noact():
     with Config(path="005noact") as _:
         hdlmake.main.hdlmake(['manifest-help'])
@@ -259,6 +271,199 @@ def test_sub_fetch():
         hdlmake.main.hdlmake(['fetch'])
         shutil.rmtree('ipcores')
 
+def test_jobs_option():
+    # More like a unittest: the number of jobs must be at least 1
+    parser = hdlmake.main._get_parser()
+    assert parser.parse_args(["-j", "4", "fetch"]).jobs == 4
+    for value in ("0", "-2", "x"):
+        with pytest.raises(SystemExit) as _:
+            parser.parse_args(["-j", value, "fetch"])
+
+def test_fetch_jobs(caplog):
+    with Config(path="099fetch_jobs") as _:
+        with pytest.raises(SystemExit) as _:
+            hdlmake.main.hdlmake(['--no-cache', '-j', '3', 'fetch'])
+        # The failures don't stop the other fetches, nor the submodules
+        assert sorted(os.listdir('ipcores')) == ['module1', 'module2',
+                                                  'module3']
+        assert "Unable to fetch 2 module(s)" in caplog.text
+        shutil.rmtree('ipcores')
+
+def test_git_mirror(tmpdir, monkeypatch):
+    # Use the real git, with a local bare repository as the remote
+    import subprocess
+    def git(*args):
+        subprocess.check_output(("git", "-c", "user.name=test",
+                                 "-c", "user.email=test@test.org") + args,
+                                cwd=str(tmpdir), stderr=subprocess.STDOUT)
+    git("init", "--quiet", "-b", "main", "work")
+    tmpdir.join("work", "Manifest.py").write("files = []\n")
+    git("-C", "work", "add", "Manifest.py")
+    git("-C", "work", "commit", "--quiet", "-m", "First")
+    git("clone", "--quiet", "--bare", "work", "core.git")
+    remote = str(tmpdir.join("core.git"))
+    for name in ("ws1", "ws2"):
+        tmpdir.join(name, "Manifest.py").write(
+            'fetchto = "ipcores"\nfetch_mirror = "../mirror"\n'
+            'modules = {{ "git" : "{}::main" }}\n'.format(remote),
+            ensure=True)
+    monkeypatch.delenv("HDLMAKE_GIT_MIRROR", raising=False)
+    monkeypatch.chdir(tmpdir.join("ws1"))
+    hdlmake.main.hdlmake(['--no-cache', 'fetch'])
+    mirrors = tmpdir.join("mirror").listdir()
+    assert len(mirrors) == 1 and mirrors[0].basename.startswith("core-")
+    assert tmpdir.join("ws1", "ipcores", "core", "Manifest.py").check()
+    # The second workspace is cloned from the mirror, offline
+    tmpdir.join("core.git").rename(tmpdir.join("core.moved"))
+    monkeypatch.chdir(tmpdir.join("ws2"))
+    hdlmake.main.hdlmake(['--no-cache', 'fetch'])
+    assert tmpdir.join("ws2", "ipcores", "core", "Manifest.py").check()
+    origin = subprocess.check_output(
+        ["git", "remote", "get-url", "origin"],
+        cwd=str(tmpdir.join("ws2", "ipcores", "core")))
+    assert origin.decode().strip() == remote
+    # The mirror is updated for a missing branch
+    tmpdir.join("core.moved").rename(tmpdir.join("core.git"))
+    git("-C", "work", "push", "--quiet", remote, "main:dev")
+    tmpdir.join("ws3", "Manifest.py").write(
+        tmpdir.join("ws1", "Manifest.py").read().replace("main", "dev"),
+        ensure=True)
+    monkeypatch.chdir(tmpdir.join("ws3"))
+    hdlmake.main.hdlmake(['--no-cache', 'fetch'])
+    assert tmpdir.join("ws3", "ipcores", "core", "Manifest.py").check()
+
+def test_git_fetch_strategies(tmpdir, monkeypatch):
+    # Use the real git, with a local bare repository as the remote
+    import subprocess
+    def git(*args, **kwargs):
+        return subprocess.check_output(
+            ("git", "-c", "user.name=test", "-c", "user.email=test@test.org")
+            + args, cwd=kwargs.get("cwd", str(tmpdir)),
+            stderr=subprocess.STDOUT).decode().strip()
+    git("init", "--quiet", "-b", "main", "work")
+    tmpdir.join("work", "Manifest.py").write('files = ["rtl/a.vhd"]\n')
+    tmpdir.join("work", "rtl", "a.vhd").write("", ensure=True)
+    tmpdir.join("work", "doc", "manual.txt").write("", ensure=True)
+    git("-C", "work", "add", ".")
+    git("-C", "work", "commit", "--quiet", "-m", "First")
+    first = git("-C", "work", "rev-parse", "HEAD")
+    tmpdir.join("work", "doc", "manual.txt").write("Second")
+    git("-C", "work", "commit", "--quiet", "-a", "-m", "Second")
+    git("clone", "--quiet", "--bare", "work", "core.git")
+    remote = "file://" + str(tmpdir.join("core.git"))
+    monkeypatch.delenv("HDLMAKE_GIT_MIRROR", raising=False)
+    def fetch(strategy, ref):
+        workspace = tmpdir.join(strategy + ref[:2])
+        workspace.join("Manifest.py").write(
+            'fetchto = "ipcores"\nfetch_strategy = "{}"\n'
+            'modules = {{ "git" : "{}{}" }}\n'.format(strategy, remote, ref),
+            ensure=True)
+        monkeypatch.chdir(workspace)
+        hdlmake.main.hdlmake(['--no-cache', 'fetch'])
+        return str(workspace.join("ipcores", "core"))
+    core = fetch("shallow", "::main")
+    assert git("rev-list", "--count", "HEAD", cwd=core) == "1"
+    assert git("rev-parse", "--abbrev-ref", "HEAD", cwd=core) == "main"
+    core = fetch("shallow", "@@" + first)
+    assert git("rev-parse", "HEAD", cwd=core) == first
+    assert git("rev-list", "--count", "HEAD", cwd=core) == "1"
+    core = fetch("partial", "::main")
+    assert git("rev-list", "--count", "HEAD", cwd=core) == "2"
+    core = fetch("sparse", "::main")
+    assert os.path.isfile(os.path.join(core, "rtl", "a.vhd"))
+    assert not os.path.exists(os.path.join(core, "doc"))
+
+def test_fetch_lock(tmpdir, monkeypatch):
+    # Use the real git, with local bare repositories as the remotes
+    import json
+    import subprocess
+    from hdlmake.fetch.git import Git
+    def git(*args, **kwargs):
+        return subprocess.check_output(
+            ("git", "-c", "user.name=test", "-c", "user.email=test@test.org")
+            + args, cwd=kwargs.get("cwd", str(tmpdir)),
+            stderr=subprocess.STDOUT).decode().strip()
+    commits = {}
+    for name in ("core", "other"):
+        git("init", "--quiet", "-b", "main", name)
+        tmpdir.join(name, "Manifest.py").write("files = []\n")
+        git("-C", name, "add", "Manifest.py")
+        git("-C", name, "commit", "--quiet", "-m", "First")
+        commits[name] = [git("-C", name, "rev-parse", "HEAD")]
+        git("-C", name, "commit", "--quiet", "--allow-empty", "-m", "Second")
+        commits[name].append(git("-C", name, "rev-parse", "HEAD"))
+        git("clone", "--quiet", "--bare", name, name + ".git")
+    tmpdir.join("ws", "Manifest.py").write(
+        'fetchto = "ipcores"\nmodules = {{ "git" : [ "{0}::main", '
+        '"{1}::main" ] }}\n'.format(tmpdir.join("core.git"),
+                                      tmpdir.join("other.git")), ensure=True)
+    monkeypatch.delenv("HDLMAKE_GIT_MIRROR", raising=False)
+    monkeypatch.chdir(tmpdir.join("ws"))
+    hdlmake.main.hdlmake(['--no-cache', 'fetch'])
+    lock = json.loads(tmpdir.join("ws", "hdlmake.lock").read())["modules"]
+    assert sorted(entry["locked"] for entry in lock.values()) == \
+        sorted([commits["core"][1], commits["other"][1]])
+    # A new fetch checks out the locked commit, not the new remote head
+    git("-C", "core", "commit", "--quiet", "--allow-empty", "-m", "Third")
+    git("-C", "core", "push", "--quiet", str(tmpdir.join("core.git")), "main")
+    tmpdir.join("ws", "ipcores", "core").remove()
+    hdlmake.main.hdlmake(['--no-cache', 'fetch'])
+    core = str(tmpdir.join("ws", "ipcores", "core"))
+    assert git("rev-parse", "HEAD", cwd=core) == commits["core"][1]
+    # Only the diverged module is checked out again, without the remote
+    git("checkout", "--quiet", commits["core"][0], cwd=core)
+    tmpdir.join("core.git").rename(tmpdir.join("core.moved"))
+    updated = []
+    update = Git.update
+    def record_update(self, module, revision):
+        updated.append(module.url)
+        return update(self, module, revision)
+    monkeypatch.setattr(Git, "update", record_update)
+    hdlmake.main.hdlmake(['--no-cache', 'fetch', '--verify'])
+    assert updated == [str(tmpdir.join("core.git"))]
+    assert git("rev-parse", "HEAD", cwd=core) == commits["core"][1]
+
+def test_command_runner(tmpdir):
+    # More like a unittest: no shell, limited concurrency, structured errors
+    import sys
+    import time
+    from hdlmake.util.runner import CommandRunner, CommandError
+    runner = CommandRunner(jobs=2)
+    result = runner.run([sys.executable, "-c", "import sys; print(sys.argv)",
+                         "a b", "$HOME;"], cwd=str(tmpdir))
+    assert result.first_line() == "['-c', 'a b', '$HOME;']"
+    lines = []
+    runner.run([sys.executable, "-c", "print(1); print(2)"],
+               echo=lines.append)
+    assert lines == ["1", "2"]
+    start = time.time()
+    sleep = [sys.executable, "-c", "import time; time.sleep(0.5)"]
+    runner.run_all([sleep] * 4)
+    assert 1.0 <= time.time() - start < 1.9
+    with pytest.raises(CommandError) as error:
+        runner.run([sys.executable, "-c",
+                    "import sys; sys.exit('broken')"])
+    assert error.value.returncode == 1 and error.value.errors == "broken"
+    with pytest.raises(CommandError) as error:
+        runner.run([sys.executable, "-c", "import time; time.sleep(10)"],
+                   timeout=0.2)
+    assert error.value.timeout == 0.2
+    with pytest.raises(CommandError) as error:
+        runner.run([str(tmpdir.join("missing"))])
+    assert error.value.returncode is None
+    # The limit of jobs is only changed when no command is running
+    with pytest.raises(ValueError) as _:
+        runner.configure(jobs=0)
+    future = runner._submit(sleep, None, None, None)
+    time.sleep(0.1)
+    with pytest.raises(RuntimeError) as _:
+        runner.configure(jobs=1)
+    future.result()
+    runner.configure(jobs=1)
+    start = time.time()
+    runner.run_all([sleep] * 2)
+    assert time.time() - start >= 1.0
+
 def test_err_fetch():
     with pytest.raises(SystemExit) as _:
         run([], path="065fetch_pre_post")
@@ -393,6 +598,48 @@ def test_configparser_unexpected_key():
     with pytest.raises(RuntimeError) as _:
         p.add_allowed_key("a", key="k")
 
+def test_configparser_change_dir(tmpdir):
+    # More like a unittest: the manifest is executed from its directory,
+    # unless change_dir is False
+    tmpdir.mkdir("rtl").join("a.vhd").write("")
+    manifest = tmpdir.join("Manifest.py")
+    manifest.write("import os\nhere = os.getcwd()\nfiles = os.listdir('rtl')\n")
+    p = ConfigParser()
+    assert p.parse(str(manifest), {})["here"] == str(tmpdir)
+    assert os.getcwd() != str(tmpdir)
+    manifest.write("import os\nhere = os.getcwd()\n")
+    p.change_dir = False
+    assert p.parse(str(manifest), {})["here"] == os.getcwd()
+
+def test_configparser_layered_context(tmpdir):
+    # More like a unittest: inherited variables are real globals, never
+    # modified
+    from hdlmake.manifest_parser.configparser import ManifestContext
+    top = {"files": ["top.vhd"], "prefix": "sub_", "count": 1,
+           "target": "xilinx"}
+    shared = ManifestContext(top).new_child()
+    manifest = tmpdir.join("Manifest.py")
+    manifest.write("def bump():\n    global count\n    count += 1\n"
+                   "bump()\n"
+                   "names = [prefix + n for n in 'ab']\n"
+                   "here = __manifest\n"
+                   "has_files = 'files' in globals()\n"
+                   "is_xilinx = globals().get('target') == 'xilinx'\n"
+                   "has_prefix = 'prefix' in globals()\n")
+    for child in range(2):
+        context = shared.new_child()
+        context["__manifest"] = "dir{}".format(child)
+        options = ConfigParser().parse(str(manifest), context)
+        assert options["names"] == ["sub_a", "sub_b"]
+        assert options["here"] == "dir{}".format(child)
+        assert options["has_files"] is False
+        assert options["is_xilinx"] is True
+        assert options["has_prefix"] is True
+        assert "files" not in context
+    assert top == {"files": ["top.vhd"], "prefix": "sub_", "count": 1,
+                   "target": "xilinx"}
+    assert shared.namespace()["count"] == 1
+
 def test_err_manifest_type():
     with pytest.raises(SystemExit) as _:
         run([], path="050err_manifest_type")
@@ -428,6 +675,353 @@ def test_dep_level():
     run(['list-files', '--reverse'], path="053vlog_dep_level")
     run(['list-files', '--top', 'level2'], path="053vlog_dep_level")
 
+def test_parse_cache(capsys):
+    with Config(path="053vlog_dep_level") as _:
+        shutil.rmtree('.hdlmake-cache', ignore_errors=True)
+        hdlmake.main.hdlmake(['list-files'])
+        ref = capsys.readouterr().out
+        assert os.path.isfile('.hdlmake-cache/parse.json')
+        hdlmake.main.hdlmake(['list-files'])
+        assert capsys.readouterr().out == ref
+        hdlmake.main.hdlmake(['--no-cache', 'list-files'])
+        assert capsys.readouterr().out == ref
+        shutil.rmtree('.hdlmake-cache')
+
+def test_parse_jobs(capsys):
+    with Config(path="087many_modules") as _:
+        hdlmake.main.hdlmake(['--no-cache', 'list-files'])
+        ref = capsys.readouterr().out
+        hdlmake.main.hdlmake(['--no-cache', '-j', '3', 'list-files'])
+        assert capsys.readouterr().out == ref
+
+def test_manifest_code_cache(capsys, monkeypatch):
+    import hdlmake.manifest_parser.code_cache
+    with Config(path="087many_modules") as _:
+        shutil.rmtree('.hdlmake-cache', ignore_errors=True)
+        hdlmake.main.hdlmake(['list-files'])
+        ref = capsys.readouterr().out
+        assert os.path.isfile('.hdlmake-cache/manifests.marshal')
+        def no_compile(*args):
+            raise AssertionError("manifest compiled again")
+        monkeypatch.setattr(hdlmake.manifest_parser.code_cache, "compile",
+                            no_compile, raising=False)
+        hdlmake.main.hdlmake(['list-files'])
+        assert capsys.readouterr().out == ref
+        shutil.rmtree('.hdlmake-cache')
+
+def test_dep_level_deep_chain():
+    # More like a unittest: far deeper than the recursion limit
+    files = [DepFile("/chain/f{:05d}.v".format(i), None) for i in range(5000)]
+    for prev, cur in zip(files, files[1:]):
+        cur.depends_on.add(prev)
+    assert new_dep_solver.make_dependency_sorted_list(files[::-1]) == files
+    assert files[-1].get_dep_level() == 4999
+
+def test_dep_level_cycle():
+    # More like a unittest: the files in a loop are kept together
+    a, b, c, d = [DepFile("/cycle/{}.v".format(n), None) for n in "abcd"]
+    a.depends_on.add(c)
+    c.depends_on.add(a)
+    c.depends_on.add(d)
+    components = new_dep_solver.find_strongly_connected([a, b, c, d])
+    assert [a, c] in components
+    assert new_dep_solver.make_dependency_sorted_list([a, b, c, d]) == \
+        [b, d, a, c]
+    assert a.get_dep_level() == c.get_dep_level() == 1
+
+def test_vhdl_single_scan(tmpdir):
+    # More like a unittest: constructs hidden inside others are still found
+    from hdlmake.sourcefiles.srcfile import VHDLFile
+    from hdlmake.sourcefiles.dep_file import DepRelation
+    src = tmpdir.join("top.vhd")
+    src.write("""library ieee;
+use ieee.std_logic_1164.all;
+entity top is port (clk : in std_logic); end top;
+architecture rtl of top is
+  signal s : std_logic -- missing semicolon
+use work.pkg.all;
+begin
+  u0: entity work.sub port map (clk => clk); -- u1: other port map
+end rtl;
+""")
+    vhdl_file = VHDLFile(path=str(src), module=None, library="lib")
+    vhdl_file.parser.parse(vhdl_file)
+    assert vhdl_file.provides == set([
+        DepRelation("top", "lib", DepRelation.ENTITY),
+        DepRelation("top", "lib", DepRelation.ARCHITECTURE)])
+    assert vhdl_file.requires == set([
+        DepRelation("std_logic_1164", "ieee", DepRelation.PACKAGE),
+        DepRelation("pkg", "lib", DepRelation.PACKAGE),
+        DepRelation("top", "lib", DepRelation.ENTITY),
+        DepRelation("sub", "lib", DepRelation.ENTITY)])
+
+def test_vlog_include_cache(tmpdir):
+    # More like a unittest: the include file is tokenized once for both files
+    from hdlmake.sourcefiles.srcfile import VerilogFile
+    from hdlmake.sourcefiles.vlog_parser import IncludeCache
+    inc = tmpdir.join("defs.vh")
+    inc.write("`define SUB sub_a\n")
+    for name in ("a", "b"):
+        tmpdir.join(name + ".v").write(
+            '`include "defs.vh"\nmodule {}; `SUB u(); endmodule\n'.format(name))
+    with IncludeCache.activate() as cache:
+        files = [VerilogFile(path=str(tmpdir.join(name + ".v")), module=None)
+                 for name in ("a", "b")]
+        for vlog_file in files:
+            vlog_file.parser.parse(vlog_file)
+        assert list(cache.entries) == [str(inc)]
+        inc.write("`define SUB sub_bb\n")
+        vlog_file = VerilogFile(path=str(tmpdir.join("a.v")), module=None)
+        vlog_file.parser.parse(vlog_file)
+    assert IncludeCache.current is None
+    assert [str(rel) for rel in files[1].requires] == ["module 'work.sub_a'"]
+    assert [str(rel) for rel in vlog_file.requires] == ["module 'work.sub_bb'"]
+
+def test_vlog_include_resolve(tmpdir, monkeypatch):
+    # More like a unittest: one stat per distinct directory and include
+    from hdlmake.sourcefiles.vlog_parser import IncludeCache
+    dirs = [str(tmpdir.mkdir("inc{}".format(i))) for i in range(40)]
+    tmpdir.join("inc39", "defs.vh").write("")
+    parents = [str(tmpdir.mkdir("rtl{}".format(i))) for i in range(3)]
+    stats = []
+    isfile = os.path.isfile
+    monkeypatch.setattr(os.path, "isfile",
+                        lambda path: stats.append(path) or isfile(path))
+    cache = IncludeCache()
+    found = os.path.join(dirs[39], "defs.vh")
+    for parent in parents:
+        assert cache.resolve("defs.vh", parent, dirs) == found
+        assert cache.resolve("missing.vh", parent, dirs) is None
+    assert cache.resolve("defs.vh", None, dirs[::-1]) == found
+    assert len(stats) == len(set(stats)) == 2 * (len(dirs) + len(parents))
+
+def test_vlog_scanner():
+    # More like a unittest: constructs found by the Verilog token scanner
+    from hdlmake.sourcefiles.vlog_parser import VerilogParser, _ModuleScanner
+    buf = """package pkg; endpackage
+module a; endmodule
+module automatic b #(parameter W = (8)) (input [(W-1):0] d);
+  function f(input x); sub_f u (x); endfunction
+  if (W > f(1)) begin : g sub_g #(.W(W)) u [1:0] (.d(d)); end
+  nand u_gate (d[0], d[1], d[2]);
+  $display("(;");
+  sub_x u_x (.d(d)), u_y (.d(d));
+endmodule
+module c (input a,
+"""
+    assert list(_ModuleScanner(buf, VerilogParser.reserved_set).scan()) == [
+        ("package", "pkg"), ("module", "a"), ("module", "b"),
+        ("instance", "sub_g", "u"), ("instance", "sub_x", "u_x")]
+
+def test_module_pool_diamond(tmpdir, monkeypatch):
+    # More like a unittest: a module shared by two parents is added once
+    from hdlmake.action.action import Action
+    tmpdir.mkdir("ip").join("Manifest.py").write("files = []\n")
+    for name in ("a", "b"):
+        tmpdir.mkdir(name).join("Manifest.py").write(
+            "modules = {'local': ['../ip']}\n")
+    tmpdir.mkdir("top").join("Manifest.py").write(
+        "modules = {'local': ['../a', '../b', '../a']}\n")
+    monkeypatch.chdir(tmpdir.join("top"))
+    options = hdlmake.main._get_parser().parse_args(
+        ["--no-cache", "list-mods"])
+    action = Action(options)
+    action.load_all_manifests()
+    assert [os.path.basename(mod.url) for mod in action.manifests] == \
+        ["top", "a", "b", "ip"]
+    mod_a, mod_b = action.manifests[1:3]
+    assert mod_a.modules['local'] == mod_b.modules['local']
+    assert action.top_manifest.modules['local'] == [mod_a, mod_b, mod_a]
+
+def test_module_pool_cache(tmpdir, monkeypatch):
+    # More like a unittest: the manifests are only parsed when changed
+    from hdlmake.action.action import Action
+    from hdlmake.manifest_parser.manifestparser import ManifestParser
+    tmpdir.mkdir("ip").mkdir("rtl").join("a.vhd").write("")
+    tmpdir.join("ip", "Manifest.py").write(
+        "import os\ndef rtl():\n    return 'rtl'\nfiles = [rtl()]\n")
+    tmpdir.mkdir("top").join("Manifest.py").write(
+        "modules = {'local': ['../ip']}\n")
+    monkeypatch.chdir(tmpdir.join("top"))
+    options = hdlmake.main._get_parser().parse_args(
+        ["--pool-cache", "list-files"])
+    parse = ManifestParser.parse
+    parsed = []
+    monkeypatch.setattr(ManifestParser, "parse",
+        lambda self, config_file, **kwargs: parsed.append(config_file) or
+        parse(self, config_file=config_file, **kwargs))
+
+    def load_files():
+        action = Action(options)
+        action.load_all_manifests()
+        return sorted(os.path.basename(f.path)
+                      for f in action.build_complete_file_set())
+    assert load_files() == ["a.vhd"]
+    assert len(parsed) == 2
+    assert load_files() == ["a.vhd"]
+    assert len(parsed) == 2
+    tmpdir.join("ip", "rtl", "b.vhd").write("")
+    assert load_files() == ["a.vhd", "b.vhd"]
+    assert len(parsed) == 4
+    # Without the flag, the manifests are always parsed
+    options.pool_cache = False
+    assert load_files() == ["a.vhd", "b.vhd"]
+    assert len(parsed) == 6
+
+def test_module_files_glob(tmpdir, monkeypatch):
+    # More like a unittest: every directory is scanned once, no file stat
+    from hdlmake.action.action import Action
+    rtl = tmpdir.mkdir("ip").mkdir("rtl")
+    for name in ("a.vhd", "c.v", ".b.vhd", "sub/b.vhd", "sub/x/d.vhd"):
+        rtl.join(name).write("", ensure=True)
+    tmpdir.join("ip", "Manifest.py").write(
+        "files = ['rtl/**/*.vhd', 'rtl/c.v']\n")
+    tmpdir.mkdir("top").join("Manifest.py").write(
+        "modules = {'local': ['../ip']}\n")
+    monkeypatch.chdir(tmpdir.join("top"))
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir",
+                        lambda path: scanned.append(path) or scandir(path))
+    stats = []
+    for name in ("exists", "isdir", "isfile"):
+        function = getattr(os.path, name)
+        monkeypatch.setattr(os.path, name, lambda path, function=function:
+                            stats.append(path) or function(path))
+    options = hdlmake.main._get_parser().parse_args(
+        ["--no-cache", "list-files"])
+    action = Action(options)
+    action.load_all_manifests()
+    assert sorted(os.path.relpath(f.path, str(rtl))
+                  for f in action.build_complete_file_set()) == \
+        ["a.vhd", "c.v", "sub/b.vhd", "sub/x/d.vhd"]
+    assert len(scanned) == len(set(scanned)) == 3
+    assert not [path for path in stats if "rtl" in str(path)]
+
+def test_module_files_brackets(tmpdir, monkeypatch):
+    # More like a unittest: an existing file name is not a glob pattern
+    from hdlmake.action.action import Action
+    rtl = tmpdir.mkdir("rtl")
+    for name in ("a[1].vhd", "a1.vhd", "b2.vhd"):
+        rtl.join(name).write("")
+    tmpdir.join("Manifest.py").write(
+        "files = ['rtl/a[1].vhd', 'rtl/b[12].vhd']\n")
+    monkeypatch.chdir(tmpdir)
+    options = hdlmake.main._get_parser().parse_args(
+        ["--no-cache", "list-files"])
+    action = Action(options)
+    action.load_all_manifests()
+    assert sorted(os.path.basename(f.path)
+                  for f in action.build_complete_file_set()) == \
+        ["a[1].vhd", "b2.vhd"]
+
+def test_source_file_slots(monkeypatch):
+    # More like a unittest: no per-file dict, parser nor include_dirs copy
+    from hdlmake.sourcefiles.srcfile import create_source_file
+    files = [create_source_file("/ip/rtl/{}".format(name), None, "work",
+                                ["/ip/include"])
+             for name in ("a.v", "b.v", "c.sv", "d.vhd", "e.vhd")]
+    assert not any(hasattr(f, "__dict__") for f in files)
+    assert files[0].parser is files[1].parser is files[2].parser
+    assert files[3].parser is files[4].parser
+    assert files[0].include_dirs is files[2].include_dirs
+    assert files[0].include_dirs[0] == "/ip/include"
+    assert files[3]._provides is None
+    files[3].provides.add(1)
+    assert files[3].provides == set([1]) and not files[4].provides
+    # The dir of the file is relative to the current directory
+    monkeypatch.chdir("/")
+    moved = create_source_file("/ip/rtl/a.v", None, "work", ["/ip/include"])
+    assert moved.include_dirs[-1] == os.path.join("ip", "rtl")
+
+def test_dep_relation_interned():
+    # More like a unittest: equal relations are the same object
+    import pickle
+    from hdlmake.sourcefiles.dep_file import DepRelation
+    rel = DepRelation("Counter", "Work", DepRelation.ENTITY)
+    assert DepRelation("counter", "work", DepRelation.MODULE) is rel
+    assert DepRelation("counter", "work", DepRelation.PACKAGE) is not rel
+    assert pickle.loads(pickle.dumps(rel)) is rel
+    assert rel.key == (DepRelation.ENTITY, "work", "counter")
+    with pytest.raises(AttributeError) as _:
+        rel.obj_name = "other"
+    # The relations no longer used are not kept
+    DepRelation("unused", "work", DepRelation.PACKAGE)
+    assert (DepRelation.PACKAGE, "work", "unused") not in \
+        DepRelation._instances
+
+def test_source_file_set_buckets():
+    # More like a unittest: filter and sort views follow the modifications
+    from hdlmake.sourcefiles.srcfile import (create_source_file, VHDLFile,
+                                             VerilogFile, SVFile)
+    from hdlmake.sourcefiles.sourcefileset import SourceFileSet
+    from hdlmake.sourcefiles.dep_file import DepFile
+    files = [create_source_file("/rtl/" + name, None)
+             for name in ("d.vhd", "c.v", "b.sv", "a.ucf")]
+    fileset = SourceFileSet()
+    fileset.add(set(files[:3]))
+    assert fileset.filter(VerilogFile) == set(files[1:3])
+    assert fileset.filter(VerilogFile) is fileset.filter(VerilogFile)
+    assert [f.path for f in fileset.sort()] == ["/rtl/b.sv", "/rtl/c.v",
+                                                "/rtl/d.vhd"]
+    fileset.add(files[3])
+    fileset.discard(files[1])
+    assert fileset.filter(VerilogFile) == set([files[2]])
+    assert fileset.filter((VHDLFile, SVFile)) == set([files[0], files[2]])
+    assert fileset.filter(DepFile) == set(files[0:3:2])
+    assert fileset.sort()[0].path == "/rtl/a.ucf"
+    fileset -= set([files[0]])
+    assert not fileset.filter(VHDLFile)
+    # The shared filtered sets are read only
+    view = fileset.filter(VerilogFile)
+    with pytest.raises(TypeError) as _:
+        view.add(files[1])
+    with pytest.raises(TypeError) as _:
+        view -= set(files)
+    assert fileset.filter(VerilogFile) == set([files[2]])
+
+def test_incremental_solve(tmpdir, monkeypatch):
+    # More like a unittest: only the changed files are parsed again, and a
+    # changed header is parsed again with every file including it
+    from hdlmake.sourcefiles.srcfile import create_source_file
+    from hdlmake.sourcefiles.sourcefileset import SourceFileSet
+    from hdlmake.sourcefiles.vlog_parser import VerilogParser
+    tmpdir.join("hdr.vh").write("`define WIDTH 8\n")
+    tmpdir.join("top.v").write(
+        '`include "hdr.vh"\nmodule top; sub u_sub(); endmodule\n')
+    tmpdir.join("sub.v").write("module sub; endmodule\n")
+    tmpdir.join("other.v").write("module other; sub u_sub(); endmodule\n")
+    cache_dir = str(tmpdir.join("cache"))
+    parse = VerilogParser.parse
+    parsed = []
+    def record_parse(self, dep_file):
+        parsed.append(os.path.basename(dep_file.path))
+        return parse(self, dep_file)
+    monkeypatch.setattr(VerilogParser, "parse", record_parse)
+    def solve():
+        del parsed[:]
+        files = dict((name, create_source_file(str(tmpdir.join(name)), None))
+                     for name in ("top.v", "sub.v", "other.v"))
+        fileset = SourceFileSet()
+        fileset.add(set(files.values()))
+        new_dep_solver.solve(fileset, cache_dir=cache_dir)
+        return dict((name, sorted(os.path.basename(dep.path)
+                                  for dep in dep_file.depends_on))
+                    for name, dep_file in files.items())
+    graph = {"top.v": ["sub.v"], "sub.v": [], "other.v": ["sub.v"]}
+    assert solve() == graph
+    assert sorted(parsed) == ["other.v", "sub.v", "top.v"]
+    assert solve() == graph
+    assert parsed == []
+    # The change of the header propagates to the including file
+    tmpdir.join("hdr.vh").write("`define WIDTH 16\n")
+    assert solve() == graph
+    assert parsed == ["top.v"]
+    # The files requiring the module of a changed file are linked again
+    tmpdir.join("sub.v").write("module sub2; endmodule\n")
+    assert solve() == {"top.v": [], "sub.v": [], "other.v": []}
+    assert parsed == ["sub.v"]
+
 def test_modelsim_windows():
     assert hdlmake.util.shell.check_windows_tools() is False
     run_compare(path="057msim_windows", my_os='windows')